@@ -1,7 +1,7 @@
 # Gunicorn configuration file
 
-# Worker class
-worker_class = "uvicorn.workers.UvicornWorker"
+# Worker class: UvicornWorker running on uvloop + httptools
+worker_class = "sentinel.workers.SentinelUvicornWorker"
 
 # Number of worker processes
 workers = 4
@@ -9,6 +9,10 @@ workers = 4
 # The socket to bind to
 bind = "0.0.0.0:8000"
 
+# Pending-connection queue; a deeper backlog absorbs connection bursts
+# instead of dropping SYNs
+backlog = 2048
+
 # Log level
 loglevel = "info"
 
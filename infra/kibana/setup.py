@@ -1,46 +1,47 @@
 
+import asyncio
 import httpx
-import time
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
 KIBANA_URL = "http://kibana:5601"
 
-def wait_for_kibana():
-    """Wait for Kibana to be available."""
+# Poll quickly first (warm restarts are ready within hundreds of ms), then back
+# off to the last delay for slow cold starts.
+BACKOFF_SCHEDULE = (0.2, 0.5, 1.0, 2.5, 5.0)
+
+async def wait_for_kibana(client: httpx.AsyncClient):
+    """Wait for Kibana to be available, polling with exponential backoff."""
     logging.info("Waiting for Kibana...")
+    attempt = 0
     while True:
         try:
-            response = httpx.get(f"{KIBANA_URL}/api/status")
+            response = await client.get("/api/status", timeout=2.0)
             if response.status_code == 200:
                 logging.info("Kibana is up!")
                 return
         except httpx.RequestError:
             pass
-        time.sleep(5)
+        await asyncio.sleep(BACKOFF_SCHEDULE[min(attempt, len(BACKOFF_SCHEDULE) - 1)])
+        attempt += 1
 
-def create_data_view(name: str, time_field: str):
+async def create_data_view(client: httpx.AsyncClient, name: str, time_field: str):
     """Create a Kibana data view."""
     logging.info(f"Creating data view: {name}")
     try:
-        with httpx.Client() as client:
-            response = client.post(
-                f"{KIBANA_URL}/api/data_views/data_view",
-                headers={
-                    "kbn-xsrf": "true",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "data_view": {
-                        "title": name,
-                        "name": name,
-                        "timeFieldName": time_field
-                    }
+        response = await client.post(
+            "/api/data_views/data_view",
+            json={
+                "data_view": {
+                    "title": name,
+                    "name": name,
+                    "timeFieldName": time_field
                 }
-            )
-            response.raise_for_status()
-            logging.info(f"Data view '{name}' created successfully.")
+            }
+        )
+        response.raise_for_status()
+        logging.info(f"Data view '{name}' created successfully.")
     except httpx.HTTPStatusError as e:
         if e.response.status_code == 409:
             logging.info(f"Data view '{name}' already exists.")
@@ -49,10 +50,15 @@ def create_data_view(name: str, time_field: str):
     except httpx.RequestError as e:
         logging.error(f"Error connecting to Kibana: {e}")
 
-def main():
-    wait_for_kibana()
-    create_data_view("filebeat-*", "@timestamp")
-    create_data_view("sentinel-events", "timestamp")
+async def main():
+    # One keep-alive client for every setup call instead of a connection per request
+    async with httpx.AsyncClient(
+        base_url=KIBANA_URL,
+        headers={"kbn-xsrf": "true", "Content-Type": "application/json"},
+    ) as client:
+        await wait_for_kibana(client)
+        await create_data_view(client, "filebeat-*", "@timestamp")
+        await create_data_view(client, "sentinel-events", "timestamp")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
@@ -1,13 +1,123 @@
-from fastapi import APIRouter, Security, HTTPException, Depends, Request, Query
-from datetime import datetime, timezone
-from typing import Optional
-import secrets
+from fastapi import APIRouter, Depends, HTTPException, Request, Query, Security
+from fastapi.responses import ORJSONResponse, Response, StreamingResponse
 from fastapi.security import APIKeyHeader
+from datetime import datetime, timezone
+from functools import lru_cache
+from operator import itemgetter
+from typing import AsyncIterator, Optional
+import ipaddress
+import logging
+import anyio
+import orjson
 from elasticsearch import AsyncElasticsearch
+from redis.asyncio import Redis
+from sentinel.api.msearch_batcher import MSearchBatcher
 from sentinel.config.settings import settings
+from sentinel.core.cache import cache_get_raw, cache_key, cache_set_json
 
 router = APIRouter()
-api_key_header = APIKeyHeader(name='X-API-KEY')
+
+# Declares the X-API-KEY scheme in OpenAPI (the /docs Authorize button). The
+# key itself is checked by APIKeyMiddleware, so this dependency never rejects.
+api_key_header = APIKeyHeader(name='X-API-KEY', auto_error=False)
+EVENTS_SECURITY = [Security(api_key_header)]
+
+# Configure module-level logger
+logger = logging.getLogger(__name__)
+
+# Settings read on every request, bound once at import
+PROCESSED_INDEX = settings.PROCESSED_INDEX
+HIGH_RISK_SCORE_THRESHOLD = settings.HIGH_RISK_SCORE_THRESHOLD
+API_EVENT_LIMIT = settings.API_EVENT_LIMIT
+CACHE_TTL_SECONDS = settings.CACHE_TTL_SECONDS
+
+# Body options shared by every event search: no total hit counting (the API
+# never returns totals) and an optional `_source` projection.
+SEARCH_PARAMS = {'track_total_hits': False}
+if settings.EVENT_PROJECTION_FIELDS:
+    SEARCH_PARAMS['_source'] = settings.EVENT_PROJECTION_FIELDS
+
+# Event searches send byte-identical bodies for repeated parameters (per
+# `limit`, or per memoized /events/search filter combination): let the shard
+# request cache answer repeats, preferring local shard copies.
+HOT_SEARCH_PARAMS = {**SEARCH_PARAMS, 'request_cache': True, 'preference': '_local'}
+
+# Static query templates shared by every request; only `size` varies per call.
+# These are plain dicts (the ES serializers reject MappingProxyType) and must
+# never be mutated by handlers.
+LATEST_QUERY = {'match_all': {}}
+LATEST_SORT = [{'timestamp': {'order': 'desc'}}]
+HIGH_RISK_QUERY = {'range': {'risk_score': {'gte': HIGH_RISK_SCORE_THRESHOLD}}}
+
+# /events/stream pages through a point in time with search_after instead of
+# asking every shard for the full top-N at once. `_shard_doc` is the PIT's
+# implicit tiebreaker, made explicit so `sort` values are always unique.
+STREAM_PAGE_SIZE = 100
+STREAM_KEEP_ALIVE = '1m'
+STREAM_SORT = [{'timestamp': {'order': 'desc'}}, {'_shard_doc': 'asc'}]
+STREAM_FILTER_PATH = ['pit_id', 'hits.hits._source', 'hits.hits.sort']
+
+# C-level accessor used to project `_source` out of each hit. Handlers return
+# ORJSONResponse directly so FastAPI skips its pure-Python jsonable_encoder
+# pass and orjson serializes the ES documents as-is.
+_get_source = itemgetter('_source')
+
+def _sources(es_response: dict) -> list:
+    """Extract hit sources; `hits` is absent when filter_path strips an empty result."""
+    return list(map(_get_source, es_response.get('hits', {}).get('hits', ())))
+
+# Known input shapes for /events/search, validated by a compiled regex instead
+# of Pydantic's general-purpose datetime parser
+ISO8601_PATTERN = r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d{1,6})?(?:Z|[+-]\d{2}:\d{2})?$'
+# Longest textual IPv6 form (IPv4-mapped tail); cheap bound before parsing
+IP_MAX_LENGTH = 45
+
+def _parse_iso8601(value: str, name: str) -> datetime:
+    """Parse a regex-validated ISO 8601 string; rejects impossible dates with 422."""
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f'Invalid {name}: {value}')
+
+def _parse_ip(value: str) -> str:
+    """Validate an IPv4/IPv6 address and return its canonical text form; 422 otherwise."""
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        raise HTTPException(status_code=422, detail=f'Invalid source_ip: {value}')
+
+@lru_cache(maxsize=256)
+def _build_search_body(
+    source_ip: Optional[str],
+    start_iso: Optional[str],
+    end_iso: Optional[str],
+    min_risk_score: Optional[int],
+    limit: int,
+) -> dict:
+    """
+    Build the /events/search body, memoized per filter combination.
+    Dashboards repeat the same few combinations, so the body is built once and
+    shared across requests; callers must treat it as read-only.
+    """
+    # Every criterion is a non-scoring predicate: run them in filter context so
+    # Elasticsearch skips scoring and can serve them from its filter cache.
+    query_filter = []
+    if source_ip:
+        query_filter.append({'term': {'source_ip.keyword': source_ip}})
+
+    time_range = {}
+    if start_iso:
+        time_range['gte'] = start_iso
+    if end_iso:
+        time_range['lte'] = end_iso
+    if time_range:
+        query_filter.append({'range': {'timestamp': time_range}})
+
+    if min_risk_score is not None:
+        query_filter.append({'range': {'risk_score': {'gte': min_risk_score}}})
+
+    query = {'bool': {'filter': query_filter}} if query_filter else LATEST_QUERY
+    return {'query': query, 'sort': LATEST_SORT, 'size': limit}
 
 def get_es_client(request: Request) -> AsyncElasticsearch:
     """
@@ -16,93 +126,139 @@ def get_es_client(request: Request) -> AsyncElasticsearch:
     """
     return request.app.state.es_client
 
-def get_api_key(api_key: str = Security(api_key_header)):
-    # Use secrets.compare_digest to prevent timing attacks
-    if secrets.compare_digest(api_key, settings.API_KEY):
-        return api_key
-    else:
-        raise HTTPException(
-            status_code=403,
-            detail='Could not validate credentials',
-        )
+def get_msearch_batcher(request: Request) -> MSearchBatcher:
+    """
+    Dependency to get the shared _msearch batcher from the app state.
+    Handlers submit their searches through it instead of calling the client directly.
+    """
+    return request.app.state.msearch_batcher
+
+def get_cache(request: Request) -> Optional[Redis]:
+    """
+    Dependency to get the shared Redis client, or None when caching is disabled.
+    """
+    return getattr(request.app.state, 'redis', None)
+
+async def _stream_latest(es_client: AsyncElasticsearch, limit: int) -> AsyncIterator[bytes]:
+    """
+    Yield the newest `limit` events as NDJSON, one search_after page at a time.
+
+    The point in time is opened on first iteration, so a response that never
+    starts streaming holds no PIT. It is closed in a shielded scope: on client
+    disconnect Starlette cancels the generator's task group, and an unshielded
+    close would be cancelled too.
+    """
+    pit = await es_client.open_point_in_time(index=PROCESSED_INDEX, keep_alive=STREAM_KEEP_ALIVE)
+    pit_id = pit['id']
+    search_after = None
+    remaining = limit
+    try:
+        while remaining > 0:
+            size = min(STREAM_PAGE_SIZE, remaining)
+            page = await es_client.search(
+                pit={'id': pit_id, 'keep_alive': STREAM_KEEP_ALIVE},
+                query=LATEST_QUERY,
+                sort=STREAM_SORT,
+                size=size,
+                search_after=search_after,
+                filter_path=STREAM_FILTER_PATH,
+                **SEARCH_PARAMS
+            )
+            pit_id = page.get('pit_id', pit_id)
+            hits = page.get('hits', {}).get('hits', ())
+            if not hits:
+                break
+            yield b''.join([orjson.dumps(hit['_source']) + b'\n' for hit in hits])
+            # A short page means the PIT is exhausted; skip the empty round trip
+            if len(hits) < size:
+                break
+            remaining -= len(hits)
+            search_after = hits[-1]['sort']
+    finally:
+        with anyio.CancelScope(shield=True):
+            try:
+                await es_client.close_point_in_time(id=pit_id)
+            except Exception:
+                logger.warning("Failed to close stream PIT.", exc_info=True)
 
 @router.get('/health', tags=['Monitoring'])
 def health_check():
     return {'status': 'ok'}
 
-@router.get('/events/latest', tags=['Intelligence'], dependencies=[Security(get_api_key)])
+@router.get('/events/latest', tags=['Intelligence'], dependencies=EVENTS_SECURITY)
 async def get_latest_events(
-    limit: int = Query(10, gt=0, le=settings.API_EVENT_LIMIT),
-    es_client: AsyncElasticsearch = Depends(get_es_client)
+    limit: int = Query(10, gt=0, le=API_EVENT_LIMIT),
+    batcher: MSearchBatcher = Depends(get_msearch_batcher),
+    cache: Optional[Redis] = Depends(get_cache)
 ):
-    query = {
-        'query': {'match_all': {}},
-        'sort': [{'timestamp': {'order': 'desc'}}],
-        'size': limit
-    }
-    response = await es_client.search(
-        index=settings.PROCESSED_INDEX,
-        query=query['query'],
-        sort=query['sort'],
-        size=query['size']
+    key = cache_key('latest', limit)
+    cached = await cache_get_raw(cache, key)
+    if cached is not None:
+        # Stored bytes are already the response body; skip the decode/re-encode
+        return Response(content=cached, media_type='application/json', headers={'X-Cache': 'HIT'})
+
+    es_response = await batcher.submit(
+        index=PROCESSED_INDEX,
+        query=LATEST_QUERY,
+        sort=LATEST_SORT,
+        size=limit,
+        **HOT_SEARCH_PARAMS
     )
-    return [hit['_source'] for hit in response['hits']['hits']]
+    events = _sources(es_response)
+    await cache_set_json(cache, key, events, CACHE_TTL_SECONDS)
+    return ORJSONResponse(events, headers={'X-Cache': 'MISS'})
 
-@router.get('/events/high-risk', tags=['Intelligence'], dependencies=[Security(get_api_key)])
+@router.get('/events/high-risk', tags=['Intelligence'], dependencies=EVENTS_SECURITY)
 async def get_high_risk_events(
-    limit: int = Query(25, gt=0, le=settings.API_EVENT_LIMIT),
-    es_client: AsyncElasticsearch = Depends(get_es_client)
+    limit: int = Query(25, gt=0, le=API_EVENT_LIMIT),
+    batcher: MSearchBatcher = Depends(get_msearch_batcher),
+    cache: Optional[Redis] = Depends(get_cache)
 ):
-    query = {
-        'query': {
-            'range': {
-                'risk_score': {
-                    'gte': settings.HIGH_RISK_SCORE_THRESHOLD
-                }
-            }
-        },
-        'sort': [{'timestamp': {'order': 'desc'}}],
-        'size': limit
-    }
-    response = await es_client.search(
-        index=settings.PROCESSED_INDEX,
-        query=query['query'],
-        sort=query['sort'],
-        size=query['size']
+    key = cache_key('high-risk', limit)
+    cached = await cache_get_raw(cache, key)
+    if cached is not None:
+        # Stored bytes are already the response body; skip the decode/re-encode
+        return Response(content=cached, media_type='application/json', headers={'X-Cache': 'HIT'})
+
+    es_response = await batcher.submit(
+        index=PROCESSED_INDEX,
+        query=HIGH_RISK_QUERY,
+        sort=LATEST_SORT,
+        size=limit,
+        **HOT_SEARCH_PARAMS
     )
-    return [hit['_source'] for hit in response['hits']['hits']]
+    events = _sources(es_response)
+    await cache_set_json(cache, key, events, CACHE_TTL_SECONDS)
+    return ORJSONResponse(events, headers={'X-Cache': 'MISS'})
 
-@router.get('/events/search', tags=['Intelligence'], dependencies=[Security(get_api_key)])
+@router.get('/events/search', tags=['Intelligence'], dependencies=EVENTS_SECURITY)
 async def search_events(
-    source_ip: Optional[str] = Query(None, description="Filter by source IP address"),
-    start_date: Optional[datetime] = Query(None, description="ISO 8601 format, e.g., 2024-01-01T00:00:00Z"),
-    end_date: Optional[datetime] = Query(None, description="ISO 8601 format, e.g., 2024-01-02T00:00:00Z"),
+    source_ip: Optional[str] = Query(None, max_length=IP_MAX_LENGTH, description="Filter by source IP address"),
+    start_date: Optional[str] = Query(None, pattern=ISO8601_PATTERN, description="ISO 8601 format, e.g., 2024-01-01T00:00:00Z"),
+    end_date: Optional[str] = Query(None, pattern=ISO8601_PATTERN, description="ISO 8601 format, e.g., 2024-01-02T00:00:00Z"),
     min_risk_score: Optional[int] = Query(None, ge=0, le=100, description="Minimum risk score (0-100)"),
-    limit: int = Query(100, gt=0, le=settings.API_EVENT_LIMIT),
-    es_client: AsyncElasticsearch = Depends(get_es_client)
+    limit: int = Query(100, gt=0, le=API_EVENT_LIMIT),
+    batcher: MSearchBatcher = Depends(get_msearch_batcher)
 ):
     """Advanced search for events with multiple filter criteria."""
-    query_must = []
-    if source_ip:
-        query_must.append({'term': {'source_ip.keyword': source_ip}})
-
-    time_range = {}
-    if start_date:
-        time_range['gte'] = start_date.isoformat()
-    if end_date:
-        time_range['lte'] = end_date.isoformat()
-    if time_range:
-        query_must.append({'range': {'timestamp': time_range}})
+    source_ip = _parse_ip(source_ip) if source_ip else None
+    start_iso = _parse_iso8601(start_date, 'start_date').isoformat() if start_date else None
+    end_iso = _parse_iso8601(end_date, 'end_date').isoformat() if end_date else None
 
-    if min_risk_score is not None:
-        query_must.append({'range': {'risk_score': {'gte': min_risk_score}}})
-
-    query = {'bool': {'must': query_must}} if query_must else {'match_all': {}}
+    response = await batcher.submit(
+        index=PROCESSED_INDEX,
+        **_build_search_body(source_ip, start_iso, end_iso, min_risk_score, limit),
+        **HOT_SEARCH_PARAMS
+    )
+    return ORJSONResponse(_sources(response))
 
-    response = await es_client.search(
-        index=settings.PROCESSED_INDEX,
-        query=query,
-        sort=[{'timestamp': {'order': 'desc'}}],
-        size=limit
+@router.get('/events/stream', tags=['Intelligence'], dependencies=EVENTS_SECURITY)
+async def stream_events(
+    limit: int = Query(API_EVENT_LIMIT, gt=0, le=API_EVENT_LIMIT),
+    es_client: AsyncElasticsearch = Depends(get_es_client)
+):
+    """Stream the newest events as NDJSON, paging through a point in time."""
+    return StreamingResponse(
+        _stream_latest(es_client, limit),
+        media_type='application/x-ndjson'
     )
-    return [hit['_source'] for hit in response['hits']['hits']]
\ No newline at end of file
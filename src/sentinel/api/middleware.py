@@ -0,0 +1,285 @@
+"""ASGI middleware for the Sentinel API."""
+
+from __future__ import annotations
+
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from sentinel.config.settings import settings
+
+Scope = Dict[str, Any]
+Message = Dict[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+Headers = List[Tuple[bytes, bytes]]
+
+EVENTS_PATH_PREFIX = '/api/v1/events'
+# Ad-hoc filter combinations rarely repeat; they get an ETag but are not stored
+UNCACHED_EVENTS_PATHS = frozenset({EVENTS_PATH_PREFIX + '/search'})
+HEALTH_PATH = '/api/v1/health'
+_API_KEY_BYTES = settings.API_KEY.encode('ascii')
+
+
+def _route_path(scope: Scope) -> str:
+    """Return the request path with `root_path` removed, as Starlette routes it.
+
+    Behind a mount or proxy prefix `scope['path']` still carries `root_path`,
+    so prefix checks must use this instead.
+    """
+    path = scope['path']
+    root_path = scope.get('root_path', '')
+    if root_path and path.startswith(root_path):
+        rest = path[len(root_path):]
+        if not rest or rest[0] == '/':
+            return rest
+    return path
+
+
+def _get_header(headers: Headers, name: bytes) -> Optional[bytes]:
+    """Return the first value of header `name` (lower-case) from raw ASGI headers."""
+    for key, value in headers:
+        if key == name:
+            return value
+    return None
+
+
+async def _send_json(send: Send, status: int, body: bytes) -> None:
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode('ascii')),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class HealthCheckMiddleware:
+    """Answer liveness probes on the health path with a pre-encoded body.
+
+    Load balancer and container probes hit this path far more often than any
+    other route, so it is served before routing, dependency resolution and
+    response rendering. Register it last so it is the outermost middleware.
+    """
+
+    _BODY = b'{"status":"ok"}'
+    _START = {
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(_BODY)).encode('ascii')),
+        ],
+    }
+    _BODY_MESSAGE = {'type': 'http.response.body', 'body': _BODY}
+
+    def __init__(self, app: ASGIApp, path: str = HEALTH_PATH) -> None:
+        self.app = app
+        self.path = path
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http' and _route_path(scope) == self.path:
+            await send(self._START)
+            await send(self._BODY_MESSAGE)
+            return
+        await self.app(scope, receive, send)
+
+
+class APIKeyMiddleware:
+    """Reject unauthenticated /events requests before they reach the router.
+
+    Authentication is one header scan plus a constant-time bytes comparison,
+    so authenticated requests skip FastAPI's dependency solver entirely.
+    """
+
+    _MISSING_BODY = b'{"detail":"Not authenticated"}'
+    _INVALID_BODY = b'{"detail":"Could not validate credentials"}'
+
+    def __init__(self, app: ASGIApp, path_prefix: str = EVENTS_PATH_PREFIX) -> None:
+        self.app = app
+        self.path_prefix = path_prefix
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] == 'http' and _route_path(scope).startswith(self.path_prefix):
+            supplied = _get_header(scope['headers'], b'x-api-key')
+            if supplied is None:
+                await _send_json(send, 403, self._MISSING_BODY)
+                return
+            # Use secrets.compare_digest to prevent timing attacks
+            if not secrets.compare_digest(supplied, _API_KEY_BYTES):
+                await _send_json(send, 403, self._INVALID_BODY)
+                return
+        await self.app(scope, receive, send)
+
+
+class CachedResponse(NamedTuple):
+    etag: bytes
+    headers: Headers
+    body: bytes
+    expires_at: float
+
+
+class ResponseCache:
+    """Small bounded in-process cache of rendered responses keyed by request.
+
+    Bounded by entry count and by total body bytes, since one entry may hold
+    a full listing of API_EVENT_LIMIT events. Bodies over `max_entry_bytes`
+    are not cached. Expired entries are purged oldest-first on every `set`,
+    not only when their own key is read again.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        max_entry_bytes: int = 1024 * 1024,
+    ) -> None:
+        self._entries: OrderedDict[Tuple[str, bytes], CachedResponse] = OrderedDict()
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._max_entry_bytes = max_entry_bytes
+        self._bytes = 0
+
+    def get(self, key: Tuple[str, bytes]) -> Optional[CachedResponse]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._pop(key)
+            return None
+        return entry
+
+    def set(self, key: Tuple[str, bytes], entry: CachedResponse) -> None:
+        self._pop(key)
+        self._purge_expired()
+        if len(entry.body) > self._max_entry_bytes:
+            return
+        self._entries[key] = entry
+        self._bytes += len(entry.body)
+        while len(self._entries) > self._max_entries or self._bytes > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.body)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._bytes = 0
+
+    def _pop(self, key: Tuple[str, bytes]) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= len(entry.body)
+
+    def _purge_expired(self) -> None:
+        # Entries are kept in insertion order with one max-age per app, so the
+        # expired ones are at the front
+        now = time.monotonic()
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.expires_at > now:
+                break
+            self._pop(key)
+
+
+# Process-wide cache shared by every ETagMiddleware instance
+response_cache = ResponseCache()
+
+
+class ETagMiddleware:
+    """Conditional GET and micro-caching for the /events endpoints.
+
+    Successful responses get an ETag (BLAKE2 digest of the body) and a short
+    `Cache-Control: private, max-age=...`. Within that window, repeat polls
+    are answered from memory, with `304 Not Modified` when the client's
+    `If-None-Match` still matches, without running the handler or touching
+    Elasticsearch. Streaming responses are passed through uncached, and
+    /events/search responses are tagged but never stored. Must run
+    inside APIKeyMiddleware so only authenticated requests ever reach the
+    cache.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        cache: ResponseCache = response_cache,
+        max_age_seconds: int = 2,
+    ) -> None:
+        self.app = app
+        self.cache = cache
+        self.max_age = max_age_seconds
+        self._cache_control = f'private, max-age={max_age_seconds}'.encode('ascii')
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if (
+            scope['type'] != 'http'
+            or scope['method'] != 'GET'
+            or not _route_path(scope).startswith(EVENTS_PATH_PREFIX)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        route_path = _route_path(scope)
+        key = (route_path, scope['query_string'])
+        if_none_match = _get_header(scope['headers'], b'if-none-match')
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            await self._send_cached(send, entry, if_none_match)
+            return
+
+        start: Optional[Message] = None
+        chunks: List[bytes] = []
+
+        async def capture(message: Message) -> None:
+            nonlocal start
+            if message['type'] == 'http.response.start':
+                if message['status'] != 200:
+                    start = None
+                    await send(message)
+                    return
+                start = message
+                return
+            if start is None:
+                await send(message)
+                return
+            if not chunks and message.get('more_body', False):
+                # Streaming response (e.g. NDJSON): pass it through untouched
+                # rather than buffering the whole stream
+                await send(start)
+                start = None
+                await send(message)
+                return
+            chunks.append(message.get('body', b''))
+            if message.get('more_body', False):
+                return
+
+            body = b''.join(chunks)
+            etag = b'"' + hashlib.blake2b(body, digest_size=8).hexdigest().encode('ascii') + b'"'
+            headers = [(k, v) for k, v in start['headers'] if k not in (b'etag', b'cache-control')]
+            headers += [(b'etag', etag), (b'cache-control', self._cache_control)]
+            entry = CachedResponse(etag, headers, body, time.monotonic() + self.max_age)
+            if route_path not in UNCACHED_EVENTS_PATHS:
+                # Replays must not repeat the handler's own X-Cache verdict
+                self.cache.set(key, entry._replace(headers=[h for h in headers if h[0] != b'x-cache']))
+            await self._send_cached(send, entry, if_none_match)
+
+        await self.app(scope, receive, capture)
+
+    @staticmethod
+    async def _send_cached(send: Send, entry: CachedResponse, if_none_match: Optional[bytes]) -> None:
+        if if_none_match is not None and entry.etag in (
+            tag.strip().removeprefix(b'W/') for tag in if_none_match.split(b',')
+        ):
+            await send({
+                'type': 'http.response.start',
+                'status': 304,
+                'headers': [(k, v) for k, v in entry.headers if k in (b'etag', b'cache-control')],
+            })
+            await send({'type': 'http.response.body', 'body': b''})
+            return
+        await send({'type': 'http.response.start', 'status': 200, 'headers': entry.headers})
+        await send({'type': 'http.response.body', 'body': entry.body})
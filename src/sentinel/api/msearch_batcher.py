@@ -0,0 +1,164 @@
+"""Coalesce concurrent API searches into Elasticsearch _msearch requests."""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from elasticsearch import AsyncElasticsearch
+
+# Configure module-level logger
+logger = logging.getLogger(__name__)
+
+# Per-search options that _msearch expects in the header line, not the body
+_HEADER_PARAMS = frozenset({
+    "allow_no_indices",
+    "ccs_minimize_roundtrips",
+    "expand_wildcards",
+    "ignore_unavailable",
+    "preference",
+    "request_cache",
+    "routing",
+    "search_type",
+})
+
+_Pending = Tuple[Dict[str, Any], Dict[str, Any], "asyncio.Future[Dict[str, Any]]"]
+
+
+class MSearchError(RuntimeError):
+    """Raised to a caller whose search failed inside an otherwise successful _msearch."""
+
+    def __init__(self, status: Optional[int], error: Any) -> None:
+        super().__init__(f"msearch item failed with status {status}: {error}")
+        self.status = status
+        self.error = error
+
+
+class MSearchBatcher:
+    """Group searches submitted within a short window into a single _msearch call.
+
+    Handlers await `submit(...)` exactly like a `search(...)` call; a background
+    task drains the queue, sends up to `max_batch_size` searches per request
+    and resolves each caller's future with its own entry of `responses`.
+
+    `filter_path` is applied to every _msearch response. Each entry's `status`
+    and `error` are always kept so responses still line up with their callers
+    when filtering strips everything else (e.g. a search with no hits).
+    """
+
+    def __init__(
+        self,
+        es_client: AsyncElasticsearch,
+        max_batch_size: int = 50,
+        flush_interval_seconds: float = 0.005,
+        filter_path: Optional[Sequence[str]] = None,
+    ) -> None:
+        self._es = es_client
+        self._max_batch_size = max_batch_size
+        self._flush_interval = flush_interval_seconds
+        self._msearch_params: Dict[str, Any] = {}
+        if filter_path:
+            self._msearch_params["filter_path"] = [
+                *filter_path, "responses.status", "responses.error"
+            ]
+        self._queue: asyncio.Queue[_Pending] = asyncio.Queue()
+        self._task: Optional[asyncio.Task[None]] = None
+        self._inflight: Set[asyncio.Task[None]] = set()
+
+    def start(self) -> None:
+        """Start the background batching task on the running loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self) -> None:
+        """Stop batching and fail any searches that were never sent."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+        while not self._queue.empty():
+            *_, future = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("msearch batcher is closed"))
+
+    async def submit(
+        self,
+        index: str,
+        query: Dict[str, Any],
+        sort: Optional[List[Dict[str, Any]]] = None,
+        size: Optional[int] = None,
+        **params: Any,
+    ) -> Dict[str, Any]:
+        """Queue a search and wait for its entry of the batched response.
+
+        Extra keyword `params` go to the search body as-is (e.g.
+        `track_total_hits`, `_source`), except header options such as
+        `preference` and `request_cache`, which go to the header line.
+        """
+        if self._task is None:
+            raise RuntimeError("msearch batcher is not running")
+
+        header: Dict[str, Any] = {"index": index}
+        body: Dict[str, Any] = {"query": query}
+        for name, value in params.items():
+            (header if name in _HEADER_PARAMS else body)[name] = value
+        if sort is not None:
+            body["sort"] = sort
+        if size is not None:
+            body["size"] = size
+
+        future: asyncio.Future[Dict[str, Any]] = asyncio.get_running_loop().create_future()
+        await self._queue.put((header, body, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch without blocking collection of the next batch
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: List[_Pending]) -> None:
+        searches: List[Dict[str, Any]] = []
+        for header, body, _ in batch:
+            searches.append(header)
+            searches.append(body)
+
+        try:
+            resp = await self._es.msearch(searches=searches, **self._msearch_params)
+        except Exception as exc:  # noqa: BLE001 - propagate to every waiting caller
+            logger.warning("msearch batch of %d searches failed: %r", len(batch), exc)
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        responses = resp["responses"]
+        for (*_, future), item in zip(batch, responses):
+            if future.done():  # caller went away (e.g. client disconnected)
+                continue
+            if "error" in item:
+                future.set_exception(MSearchError(item.get("status"), item["error"]))
+            else:
+                future.set_result(item)
+        for *_, future in batch[len(responses):]:
+            if not future.done():
+                future.set_exception(MSearchError(None, "missing msearch response"))
@@ -1,6 +1,11 @@
 """
 Project Sentinel Configuration Management
 Handles all application settings and environment variables
+
+Note: ES_MAX_CONNECTIONS sizes the Elasticsearch client's per-node connection
+pool. The client default (10) is far below what a Uvicorn worker serving many
+concurrent requests needs; coroutines then queue for a free connection, which
+shows up as tail latency rather than as errors.
 """
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -21,15 +26,63 @@ class Settings(BaseSettings):
     ELASTICSEARCH_VERIFY_CERTS: bool = True
     ELASTICSEARCH_CA_CERTS: str | None = None
 
+    # Elasticsearch client connection pool and timeouts
+    ES_MAX_CONNECTIONS: int = 100
+    ES_REQUEST_TIMEOUT: float = 10.0
+
+    # Optional Redis result cache for hot API reads (disabled when unset)
+    REDIS_URL: str | None = None
+    CACHE_TTL_SECONDS: int = 3
+    # Keep a slow or unreachable Redis from stalling requests; failures fall back to ES
+    REDIS_SOCKET_TIMEOUT_SECONDS: float = 0.25
+    REDIS_CONNECT_TIMEOUT_SECONDS: float = 0.25
+    # In-process ETag/response cache window for /api/v1/events/* (Cache-Control max-age)
+    RESPONSE_CACHE_MAX_AGE_SECONDS: int = 2
+
     # Application settings
     HIGH_RISK_SCORE_THRESHOLD: int = 70
-    GEOIP_RISK_COUNTRIES: list[str] = ['Russian Federation', 'China', 'Iran']
-    SUSPICIOUS_COMMANDS: list[str] = ['wget', 'curl', 'nc', 'netcat', 'nmap', 'chmod 777']
+    # Frozensets: countries are membership-tested per event, and command order
+    # does not matter to the substring matcher
+    GEOIP_RISK_COUNTRIES: frozenset[str] = frozenset({'Russian Federation', 'China', 'Iran'})
+    SUSPICIOUS_COMMANDS: frozenset[str] = frozenset({'wget', 'curl', 'nc', 'netcat', 'nmap', 'chmod 777'})
     API_EVENT_LIMIT: int = 1000
+    # Skip indexing events without any risk signal (risk score 0)
+    DROP_ZERO_SCORE: bool = True
+    # Optional list of `_source` fields returned by the API (all fields when unset)
+    EVENT_PROJECTION_FIELDS: list[str] | None = None
+
+    # Coalescing of concurrent API searches into _msearch requests
+    MSEARCH_MAX_BATCH_SIZE: int = 50
+    MSEARCH_FLUSH_INTERVAL_SECONDS: float = 0.005
+
+    # Background processor polling: the interval halves while new events keep
+    # arriving and doubles back up to the maximum while the source is idle
+    PROCESSOR_MIN_POLL_INTERVAL_SECONDS: float = 0.5
+    PROCESSOR_MAX_POLL_INTERVAL_SECONDS: float = 10.0
+
+    # Target size of one page of raw events fetched by the processor; the page
+    # size adapts to the observed average event size
+    PAGE_MAX_BYTES: int = 1024 * 1024
+
+    # Bulk indexing of processed events: documents per _bulk request, a hard
+    # cap on the request body size (whichever is reached first), and how many
+    # _bulk requests may be in flight at once
+    BULK_CHUNK_SIZE: int = 1000
+    BULK_MAX_CHUNK_BYTES: int = 10 * 1024 * 1024
+    BULK_CONCURRENCY: int = 8
+
+    # Processed index write tuning, applied by the app to the existing index at
+    # startup (new indices get the bootstrap template's 5s default).
+    # A longer refresh interval means fewer segment flushes, but API readers
+    # see new events only after the next refresh.
+    PROCESSED_INDEX_REFRESH_INTERVAL: str = '5s'
 
     # AbuseIPDB settings
     ABUSEIPDB_API_KEY: str | None = None
     ABUSEIPDB_CONFIDENCE_THRESHOLD: int = 80
+    # In-process cache of AbuseIPDB verdicts per IP
+    IP_REPUTATION_CACHE_SIZE: int = 100_000
+    IP_REPUTATION_CACHE_TTL_SECONDS: int = 3600
 
     model_config = SettingsConfigDict(env_file='.env', extra='ignore')
 
@@ -0,0 +1,46 @@
+"""Redis-backed result cache for hot API reads."""
+
+from __future__ import annotations
+
+import logging
+from typing import Any, Optional
+
+import orjson
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+# Configure module-level logger
+logger = logging.getLogger(__name__)
+
+CACHE_KEY_PREFIX = "sentinel:"
+
+
+def cache_key(namespace: str, *parts: Any) -> str:
+    """Build a namespaced cache key, e.g. ``sentinel:latest:10``."""
+    return ":".join([CACHE_KEY_PREFIX + namespace, *map(str, parts)])
+
+
+async def cache_get_raw(redis: Optional[Redis], key: str) -> Optional[bytes]:
+    """Return the cached JSON bytes for `key`, or None on miss.
+
+    Cache failures are logged and treated as a miss so the caller can always
+    fall back to Elasticsearch.
+    """
+    if redis is None:
+        return None
+    try:
+        return await redis.get(key)
+    except RedisError:
+        logger.warning("Cache read failed for key %s", key, exc_info=True)
+        return None
+
+
+async def cache_set_json(redis: Optional[Redis], key: str, value: Any, ttl_seconds: int) -> None:
+    """Store `value` under `key` for `ttl_seconds`, ignoring cache failures."""
+    if redis is None:
+        return
+    try:
+        await redis.set(key, orjson.dumps(value), ex=ttl_seconds)
+    except RedisError:
+        logger.warning("Cache write failed for key %s", key, exc_info=True)
+
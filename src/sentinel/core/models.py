@@ -14,3 +14,5 @@ class ProcessedEvent(BaseModel):
     message: Optional[str] = None
     risk_score: int = Field(..., ge=0, le=100)
     risk_factors: list[str] = Field(default_factory=list)
+    # _id of the raw Filebeat document this event was derived from
+    source_id: Optional[str] = None
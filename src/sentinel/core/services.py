@@ -3,12 +3,18 @@
 from __future__ import annotations
 
 import asyncio
+import contextlib
+import hashlib
 import logging
 from datetime import datetime, timezone, timedelta
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Mapping, Optional, Sequence
 
+import ahocorasick
 import httpx
+import orjson
+from cachetools import TTLCache
 from elasticsearch import AsyncElasticsearch, NotFoundError
+from elasticsearch.helpers import async_streaming_bulk
 
 from sentinel.config.settings import settings
 from sentinel.core.models import ProcessedEvent
@@ -17,34 +23,113 @@ from sentinel.core.models import ProcessedEvent
 logger = logging.getLogger(__name__)
 
 
-async def wait_for_elasticsearch(es_client: Any, timeout_seconds: int = 60, interval_seconds: float = 2.0) -> None:
-    """Wait until Elasticsearch responds to ping or timeout.
+# Readiness polling delays: short first polls catch the common fast-ready case,
+# the capped tail avoids hammering a slow-starting cluster.
+READINESS_BACKOFF_SCHEDULE = (0.2, 0.5, 1.0, 2.5, 5.0)
+# Longest single cluster-health long-poll; Elasticsearch holds the request
+# open and answers as soon as the cluster reaches the wanted status
+READINESS_HEALTH_WAIT_SECONDS = 30
+
+# Raw event paging: initial page size and its adaptive bounds, and sort
+# orders for plain and PIT searches
+RAW_PAGE_SIZE = 500
+RAW_PAGE_SIZE_MIN = 50
+RAW_PAGE_SIZE_MAX = 5000
+RAW_SORT = [{"@timestamp": {"order": "asc"}}]
+RAW_PIT_SORT = [{"@timestamp": {"order": "asc"}}, {"_shard_doc": "asc"}]
+# Raw fields read by _transform_and_score/_score_event, and the response parts
+# kept for plain and PIT pages (PIT pages also need `sort` and `pit_id`)
+RAW_SOURCE_FIELDS = [
+    "@timestamp", "timestamp", "eventid", "event_type", "username", "password",
+    "session", "session_id", "message", "input", "src_ip", "source_ip",
+    "src_port", "source_port", "geoip",
+]
+RAW_FILTER_PATH = ["hits.hits._id", "hits.hits._source"]
+RAW_PIT_FILTER_PATH = ["pit_id", *RAW_FILTER_PATH, "hits.hits.sort"]
+# Pages (or scored batches) buffered between ingest pipeline stages
+PIPELINE_QUEUE_SIZE = 4
+
+
+async def wait_for_elasticsearch(
+    es_client: Any,
+    timeout_seconds: int = 60,
+    backoff_schedule: Sequence[float] = READINESS_BACKOFF_SCHEDULE,
+) -> None:
+    """Wait until the Elasticsearch cluster is at least yellow or timeout.
+
+    Uses `_cluster/health?wait_for_status=yellow` as a long-poll, so readiness
+    is detected as soon as the cluster changes state. A server-side wait that
+    times out (408) is re-issued immediately; connection errors back off.
 
     Args:
-        es_client: An AsyncElasticsearch-like client with an async ping() method.
+        es_client: An AsyncElasticsearch-like client.
         timeout_seconds: Max time to wait before raising TimeoutError.
-        interval_seconds: Seconds between retries.
+        backoff_schedule: Seconds to sleep between failed connection attempts;
+            the last value repeats.
     """
     logger.info("Waiting for Elasticsearch to become ready...")
-    deadline = asyncio.get_event_loop().time() + timeout_seconds
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout_seconds
     last_error: Exception | None = None
+    attempt = 0
 
-    while asyncio.get_event_loop().time() < deadline:
+    while (remaining := deadline - loop.time()) > 0:
+        wait_seconds = max(1, min(READINESS_HEALTH_WAIT_SECONDS, int(remaining)))
         try:
-            if await es_client.ping():
-                logger.info("Elasticsearch is ready.")
+            health = await es_client.options(
+                ignore_status=408, request_timeout=wait_seconds + 5
+            ).cluster.health(wait_for_status="yellow", timeout=f"{wait_seconds}s")
+            if not health.get("timed_out"):
+                logger.info("Elasticsearch is ready (cluster status %s).", health.get("status"))
                 return
+            # The server already waited the full window: re-enter the long-poll
+            continue
         except Exception as exc:  # noqa: BLE001 - log and retry, typical for boot waiters
             last_error = exc
-        await asyncio.sleep(interval_seconds)
+        await asyncio.sleep(backoff_schedule[min(attempt, len(backoff_schedule) - 1)])
+        attempt += 1
 
     msg = "Timed out waiting for Elasticsearch to become ready."
     logger.error(msg)
     if last_error:
-        logger.debug("Last ping error: %r", last_error)
+        logger.debug("Last health check error: %r", last_error)
     raise TimeoutError(msg)
 
 
+def _processed_index_settings() -> Dict[str, Any]:
+    """Dynamic index settings tuned for the processor's bulk-write workload.
+
+    Async translog durability may lose the last few seconds of writes on a
+    node crash; the processor resumes from the newest processed timestamp, so
+    those events are simply fetched and indexed again.
+    """
+    return {
+        "refresh_interval": settings.PROCESSED_INDEX_REFRESH_INTERVAL,
+        "translog": {"durability": "async", "flush_threshold_size": "1gb"},
+    }
+
+
+async def tune_processed_index(es: AsyncElasticsearch) -> None:
+    """
+    Apply the configured write tuning to the processed index if it exists.
+
+    Mappings, codec and replicas come from the `sentinel-events-template`
+    index template, installed by the deployment's bootstrap step with admin
+    credentials; the app's own user has no cluster-level template privilege.
+    A failed update only loses the tuning, so it is logged, not raised.
+    """
+    try:
+        await es.indices.put_settings(
+            index=settings.PROCESSED_INDEX, settings={"index": _processed_index_settings()}
+        )
+    except NotFoundError:
+        logger.info("Processed index %s does not exist yet; the index template will apply on creation.",
+                    settings.PROCESSED_INDEX)
+    except Exception:
+        logger.warning("Could not update settings of processed index %s.",
+                       settings.PROCESSED_INDEX, exc_info=True)
+
+
 async def get_last_processed_timestamp(es: AsyncElasticsearch) -> datetime:
     """
     Query Elasticsearch for the most recent timestamp from the processed index.
@@ -76,42 +161,55 @@ async def get_last_processed_timestamp(es: AsyncElasticsearch) -> datetime:
         return datetime.now(timezone.utc) - timedelta(minutes=5)
 
 
-async def process_new_events(es_client: AsyncElasticsearch, poll_interval_seconds: float = 10.0) -> None:
-    """Continuously fetch recent raw events, score, and index into processed index."""
+def _next_poll_interval(current: float, had_events: bool, minimum: float, maximum: float) -> float:
+    """Halve the poll interval after a productive poll, double it after an idle one."""
+    if had_events:
+        return max(minimum, current * 0.5)
+    return min(maximum, current * 2)
+
+
+async def process_new_events(
+    es_client: AsyncElasticsearch,
+    poll_interval_seconds: float = 10.0,
+    min_poll_interval_seconds: float = 0.5,
+    http_client: Optional[httpx.AsyncClient] = None,
+) -> None:
+    """Continuously fetch recent raw events, score, and index into processed index.
+
+    Polling is adaptive: the wait between polls shrinks towards
+    `min_poll_interval_seconds` while events keep arriving and grows back to
+    `poll_interval_seconds` while the source is idle.
+
+    `http_client` is the shared client used for AbuseIPDB lookups; without
+    it, IP reputation is not checked.
+    """
     logger.info("Event processor started.")
 
     last_seen_ts = await get_last_processed_timestamp(es_client)
     consecutive_errors = 0
     MAX_CONSECUTIVE_ERRORS = 5
+    interval = min_poll_interval_seconds
 
     try:
         while True:
             try:
-                new_docs = await _fetch_recent_raw(es_client, since=last_seen_ts)
-                if new_docs:
-                    logger.info("Fetched %d new raw events since %s", len(new_docs), last_seen_ts.isoformat())
-                    processed_events = []
-                    source_hits = []
-                    
-                    # Create a list of tasks to run in parallel
-                    tasks = [_transform_and_score(hit) for hit in new_docs]
-                    results = await asyncio.gather(*tasks)
-                    
-                    for i, transformed in enumerate(results):
-                        if transformed:
-                            processed_events.append(transformed)
-                            source_hits.append(new_docs[i])
-
-                    if processed_events:
-                        await _bulk_index_processed(es_client, processed_events, source_hits=source_hits)
-
-                    # Advance watermark to max @timestamp observed
-                    max_ts = max(_extract_timestamp(h) for h in new_docs if _extract_timestamp(h))
-                    if max_ts and max_ts > last_seen_ts:
-                        last_seen_ts = max_ts
-                else:
+                fetched, newest_ts = await _run_ingest_pipeline(
+                    es_client, since=last_seen_ts, http_client=http_client
+                )
+                # Guarded so isoformat() only runs when the record is emitted
+                if fetched:
+                    if logger.isEnabledFor(logging.INFO):
+                        logger.info("Processed %d new raw events since %s", fetched, last_seen_ts.isoformat())
+                elif logger.isEnabledFor(logging.DEBUG):
                     logger.debug("No new events since %s", last_seen_ts.isoformat())
-                
+
+                # Advance watermark to max @timestamp observed
+                if newest_ts and newest_ts > last_seen_ts:
+                    last_seen_ts = newest_ts
+
+                interval = _next_poll_interval(
+                    interval, bool(fetched), min_poll_interval_seconds, poll_interval_seconds
+                )
                 consecutive_errors = 0 # Reset on success
 
             except Exception as exc:  # noqa: BLE001 - keep loop alive, log error
@@ -122,7 +220,7 @@ async def process_new_events(es_client: AsyncElasticsearch, poll_interval_second
                     raise RuntimeError("Event processor failed due to repeated errors.")
                 await asyncio.sleep(5) # Wait before retrying
 
-            await asyncio.sleep(poll_interval_seconds)
+            await asyncio.sleep(interval)
     except asyncio.CancelledError:
         logger.info("Event processor cancellation received.")
         raise
@@ -130,78 +228,266 @@ async def process_new_events(es_client: AsyncElasticsearch, poll_interval_second
         logger.info("Event processor stopped.")
 
 
+async def _run_ingest_pipeline(
+    es: AsyncElasticsearch,
+    since: datetime,
+    http_client: Optional[httpx.AsyncClient] = None,
+) -> tuple[int, Optional[datetime]]:
+    """Fetch, score and index every raw event newer than `since`.
+
+    Fetching, transformation and indexing run as three tasks connected by
+    bounded queues, so memory stays constant however large the backlog is and
+    indexing overlaps with fetching the next pages. Bulk batches are sent
+    concurrently, up to BULK_CONCURRENCY at a time.
+
+    Returns:
+        The number of raw events fetched and the newest processed timestamp,
+        or None when nothing was processed.
+    """
+    raw_pages: asyncio.Queue[Optional[List[Dict[str, Any]]]] = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    scored: asyncio.Queue[Optional[List[ProcessedEvent]]] = asyncio.Queue(PIPELINE_QUEUE_SIZE)
+    fetched = 0
+    newest_ts: Optional[datetime] = None
+
+    async def fetch_pages() -> None:
+        nonlocal fetched
+        # aclosing() runs the generator's PIT cleanup as soon as this task
+        # ends (e.g. cancelled by a failing sibling), not at GC time
+        async with contextlib.aclosing(_fetch_recent_raw(es, since=since)) as pages:
+            async for page in pages:
+                fetched += len(page)
+                await raw_pages.put(page)
+        await raw_pages.put(None)
+
+    async def transform_pages() -> None:
+        nonlocal newest_ts
+        while (page := await raw_pages.get()) is not None:
+            # One reputation lookup per unique source IP in the page
+            ip_reputation = await _lookup_ip_reputations(
+                (hit.get("_source", {}).get("src_ip") for hit in page), http_client
+            )
+            # Transform and score is pure CPU work: run it inline rather than
+            # paying task creation and scheduling per hit
+            events = [
+                transformed for hit in page
+                if (transformed := _transform_and_score(hit, ip_reputation))
+            ]
+            # Hits come back sorted by @timestamp ascending, so the last parsed
+            # hit carries the newest timestamp. Use hits rather than events so
+            # the watermark also moves past dropped zero-score events.
+            newest_ts = next(
+                (ts for hit in reversed(page) if (ts := hit.get("_parsed_ts"))), newest_ts
+            )
+            if events:
+                await scored.put(events)
+        await scored.put(None)
+
+    async def index_batch(batch: List[ProcessedEvent], slot: asyncio.Semaphore) -> None:
+        try:
+            await _bulk_index_processed(es, batch)
+        finally:
+            slot.release()
+
+    async def index_events() -> None:
+        # Up to BULK_CONCURRENCY batches are indexed at once; waiting for a free
+        # slot before reading more keeps the scored queue as backpressure
+        slot = asyncio.Semaphore(settings.BULK_CONCURRENCY)
+        done = False
+        async with asyncio.TaskGroup() as bulk_tg:
+            while not done and (batch := await scored.get()) is not None:
+                # Drain whatever else is already scored until a bulk chunk is full
+                while len(batch) < settings.BULK_CHUNK_SIZE:
+                    try:
+                        more = scored.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    if more is None:
+                        done = True
+                        break
+                    batch.extend(more)
+                await slot.acquire()
+                bulk_tg.create_task(index_batch(batch, slot))
+
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(fetch_pages())
+        tg.create_task(transform_pages())
+        tg.create_task(index_events())
+
+    return fetched, newest_ts
+
+
+try:
+    # C parser for RFC 3339 timestamps, with native "Z" support
+    from ciso8601 import parse_datetime as _parse_iso8601
+except ImportError:  # pragma: no cover - optional speedup
+    # Python 3.11+ fromisoformat also accepts a trailing "Z"
+    _parse_iso8601 = datetime.fromisoformat
+
+
 def _extract_timestamp(hit: Dict[str, Any]) -> Optional[datetime]:
-    """Extracts @timestamp from a Filebeat hit into aware datetime (UTC)."""
+    """Extracts @timestamp from a Filebeat hit into aware datetime (UTC).
+
+    The parsed value is memoized on the hit as `_parsed_ts`.
+    """
+    ts = hit.get("_parsed_ts")
+    if ts is not None:
+        return ts
+
     src = hit.get("_source", {})
     ts_str = src.get("@timestamp") or src.get("timestamp")
     if not ts_str or not isinstance(ts_str, str):
         logger.warning("Skipping event with missing or invalid timestamp: %s", hit.get("_id", "N/A"))
         return None
 
-    # Rely on fromisoformat for RFC3339; strip Z if present
     try:
-        if ts_str.endswith("Z"):
-            ts_str = ts_str[:-1] + "+00:00"
-        return datetime.fromisoformat(ts_str)
+        ts = _parse_iso8601(ts_str)
     except (ValueError, TypeError):
         logger.warning("Skipping event with malformed timestamp: %s", ts_str, exc_info=True)
         return None
+    hit["_parsed_ts"] = ts
+    return ts
+
+
+# Exponentially weighted average size of a raw hit in bytes, sampled from
+# fetched pages and carried across polls; None until the first page arrives
+_avg_raw_hit_bytes: Optional[float] = None
+_RAW_HIT_SIZE_SAMPLE = 20
+_RAW_HIT_SIZE_ALPHA = 0.2
+
+
+def _raw_page_size() -> int:
+    """Page size that keeps one page of raw hits near PAGE_MAX_BYTES."""
+    if not _avg_raw_hit_bytes:
+        return RAW_PAGE_SIZE
+    target = int(settings.PAGE_MAX_BYTES // _avg_raw_hit_bytes)
+    return max(RAW_PAGE_SIZE_MIN, min(RAW_PAGE_SIZE_MAX, target))
+
+
+def _observe_raw_page(hits: List[Dict[str, Any]]) -> None:
+    """Fold the average hit size of a fetched page into the running estimate."""
+    global _avg_raw_hit_bytes
+    sample = hits[:_RAW_HIT_SIZE_SAMPLE]
+    avg = len(orjson.dumps(sample)) / len(sample)
+    if _avg_raw_hit_bytes is None:
+        _avg_raw_hit_bytes = avg
+    else:
+        _avg_raw_hit_bytes += _RAW_HIT_SIZE_ALPHA * (avg - _avg_raw_hit_bytes)
+
+
+async def _fetch_recent_raw(es: AsyncElasticsearch, since: datetime) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Yield pages of Filebeat events newer than `since`, oldest first.
+
+    The page size is picked per poll from the observed average hit size, so
+    small events are fetched in fewer round trips and large ones never build
+    an oversized response.
+
+    Only the fields the scorer reads are fetched, and `filter_path` drops the
+    per-hit envelope the processor never looks at.
+
+    Most polls return less than one page, so the first page is a plain search.
+    Only when it comes back full is a Point in Time (PIT) opened to page through
+    the rest with `search_after`, which avoids a PIT open/close round trip on
+    every tick. A PIT is a snapshot and cannot see later writes, so it is never
+    kept across polls.
+    """
+    query = {"range": {"@timestamp": {"gt": since.isoformat()}}}
+    page_size = _raw_page_size()
+    try:
+        resp = await es.search(
+            index=settings.SOURCE_INDEX,
+            query=query,
+            sort=RAW_SORT,
+            size=page_size,
+            _source=RAW_SOURCE_FIELDS,
+            filter_path=RAW_FILTER_PATH,
+            track_total_hits=False,
+        )
+    except Exception:
+        logger.exception("Error fetching recent raw events.")
+        return
 
+    hits = resp.get("hits", {}).get("hits", [])
+    if hits:
+        _observe_raw_page(hits)
+    if len(hits) < page_size:
+        if hits:
+            yield hits
+        return
+    # Backlog: restart inside a PIT so pages are consistent with each other
+    async with contextlib.aclosing(_fetch_recent_raw_pit(es, query, page_size)) as pages:
+        async for page in pages:
+            yield page
 
-async def _fetch_recent_raw(es: AsyncElasticsearch, since: datetime) -> List[Dict[str, Any]]:
+
+async def _fetch_recent_raw_pit(
+    es: AsyncElasticsearch,
+    query: Dict[str, Any],
+    page_size: int,
+) -> AsyncIterator[List[Dict[str, Any]]]:
     """
-    Query Filebeat indices for events newer than `since` using a Point in Time (PIT)
-    and `search_after` to enable deep pagination and avoid data loss.
+    Yield pages of raw events matching `query` using a PIT and `search_after`,
+    with the `_shard_doc` tiebreaker so events sharing a timestamp are never
+    skipped or repeated across pages.
     """
-    all_hits = []
-    pit = None
+    pit_id = None
     try:
         pit = await es.open_point_in_time(index=settings.SOURCE_INDEX, keep_alive="1m")
         pit_id = pit["id"]
 
-        query = {"range": {"@timestamp": {"gt": since.isoformat()}}}
-        sort = [{"@timestamp": {"order": "asc"}}]
-        
         search_after_val = None
         while True:
             resp = await es.search(
-                body={
-                    "query": query,
-                    "size": 500,
-                    "sort": sort,
-                    "pit": {"id": pit_id, "keep_alive": "1m"},
-                    **({"search_after": search_after_val} if search_after_val else {}),
-                }
+                query=query,
+                size=page_size,
+                sort=RAW_PIT_SORT,
+                pit={"id": pit_id, "keep_alive": "1m"},
+                search_after=search_after_val,
+                _source=RAW_SOURCE_FIELDS,
+                filter_path=RAW_PIT_FILTER_PATH,
+                track_total_hits=False,
             )
+            pit_id = resp.get("pit_id", pit_id)
             hits = resp.get("hits", {}).get("hits", [])
-            if not hits:
+            if hits:
+                _observe_raw_page(hits)
+                yield hits
+            if len(hits) < page_size:
                 break
-            
-            all_hits.extend(hits)
             search_after_val = hits[-1]["sort"]
 
     except Exception:
+        # Pages already yielded are still processed
         logger.exception("Error fetching recent raw events.")
-        # In case of error, return what we have so far
-        return all_hits
     finally:
-        if pit:
+        if pit_id:
             try:
-                await es.close_point_in_time(id=pit["id"])
+                await es.close_point_in_time(id=pit_id)
             except Exception:
                 logger.exception("Error closing PIT.")
-    
-    return all_hits
 
 
-async def _transform_and_score(hit: Dict[str, Any]) -> Optional[ProcessedEvent]:
-    """Map raw Cowrie/Filebeat event to ProcessedEvent with heuristic scoring."""
+def _transform_and_score(
+    hit: Dict[str, Any],
+    ip_reputation: Optional[Mapping[str, bool]] = None,
+) -> Optional[ProcessedEvent]:
+    """Map raw Cowrie/Filebeat event to ProcessedEvent with heuristic scoring.
+
+    With DROP_ZERO_SCORE, events without any risk signal (e.g. session
+    connects, client versions) return None before the model is built.
+    """
     src = hit.get("_source", {})
     ts_dt = _extract_timestamp(hit)
     if not ts_dt:
         return None  # Skip events we can't parse a timestamp for
 
     event_type = src.get("eventid") or src.get("event_type") or "unknown"
+    score, factors = _score_event(
+        event_type=event_type, src=src, timestamp=ts_dt, ip_reputation=ip_reputation
+    )
+    if score == 0 and settings.DROP_ZERO_SCORE:
+        return None
+
     username = src.get("username")
     password = src.get("password")
     session_id = src.get("session") or src.get("session_id") or ""
@@ -210,8 +496,6 @@ async def _transform_and_score(hit: Dict[str, Any]) -> Optional[ProcessedEvent]:
     source_port = src.get("src_port") or src.get("source_port")
     geoip = src.get("geoip")
 
-    score, factors = await _score_event(event_type=event_type, src=src, timestamp=ts_dt)
-
     model = ProcessedEvent(
         timestamp=ts_dt,
         source_ip=source_ip,
@@ -224,52 +508,96 @@ async def _transform_and_score(hit: Dict[str, Any]) -> Optional[ProcessedEvent]:
         message=message,
         risk_score=score,
         risk_factors=factors,
+        source_id=hit.get("_id"),
     )
     return model
 
 
-async def _score_event(event_type: str, src: Dict[str, Any], timestamp: datetime) -> tuple[int, List[str]]:
+# --- Weights for different risk indicators ---
+WEIGHTS = {
+    "login_success": 80,
+    "login_failed": 10,
+    "privileged_account": 15,
+    "command_input": 5,
+    "suspicious_command": 30,
+    "file_transfer": 40,
+    "geo_risk": 10,
+    "night_activity": 5,  # Activity during non-business hours
+    "ip_reputation_risk": 50,
+}
+
+# Usernames whose use scores as a privileged account attempt
+_PRIVILEGED_USERS = frozenset({"root", "admin"})
+
+# Cowrie event ID -> (score delta, risk factor)
+_EVENT_TYPE_TABLE = {
+    "cowrie.login.success": (WEIGHTS["login_success"], "successful_login"),
+    "cowrie.login.failed": (WEIGHTS["login_failed"], "failed_login"),
+    "cowrie.command.input": (WEIGHTS["command_input"], "command_input"),
+    "cowrie.session.file_download": (WEIGHTS["file_transfer"], "file_transfer"),
+    "cowrie.session.file_upload": (WEIGHTS["file_transfer"], "file_transfer"),
+}
+
+
+_suspicious_matcher: Optional[tuple[frozenset[str], Optional[ahocorasick.Automaton]]] = None
+
+
+def _get_suspicious_matcher() -> Optional[ahocorasick.Automaton]:
+    """Return an Aho-Corasick automaton over SUSPICIOUS_COMMANDS, or None if empty.
+
+    Built lazily and rebuilt only when the configured command set changes, so
+    the per-event check is a single pass over the input string.
+    """
+    global _suspicious_matcher
+    # No copy when the setting is already a frozenset (the configured type)
+    commands = frozenset(settings.SUSPICIOUS_COMMANDS)
+    if _suspicious_matcher is None or (
+        _suspicious_matcher[0] is not commands and _suspicious_matcher[0] != commands
+    ):
+        automaton = None
+        if commands:
+            automaton = ahocorasick.Automaton()
+            for cmd in commands:
+                automaton.add_word(cmd, cmd)
+            automaton.make_automaton()
+        _suspicious_matcher = (commands, automaton)
+    return _suspicious_matcher[1]
+
+
+def _score_event(
+    event_type: str,
+    src: Dict[str, Any],
+    timestamp: datetime,
+    ip_reputation: Optional[Mapping[str, bool]] = None,
+) -> tuple[int, List[str]]:
     """
     Advanced heuristic risk scoring for Cowrie events.
     Uses a weighted system and considers event context.
+
+    `ip_reputation` maps source IPs to reputation verdicts prefetched with
+    `_lookup_ip_reputations`; IPs missing from it are not considered risky.
     """
     score = 0
     factors: List[str] = []
 
-    # --- Define weights for different indicators ---
-    WEIGHTS = {
-        "login_success": 80,
-        "login_failed": 10,
-        "privileged_account": 15,
-        "command_input": 5,
-        "suspicious_command": 30,
-        "file_transfer": 40,
-        "geo_risk": 10,
-        "night_activity": 5,  # Activity during non-business hours
-        "ip_reputation_risk": 50, # Placeholder for external service
-    }
-
     # --- Event Type Scoring ---
-    if "cowrie.login.success" in event_type:
-        score += WEIGHTS["login_success"]
-        factors.append("successful_login")
-    elif "cowrie.login.failed" in event_type:
-        score += WEIGHTS["login_failed"]
-        factors.append("failed_login")
-    elif "cowrie.command.input" in event_type:
-        score += WEIGHTS["command_input"]
-        factors.append("command_input")
-        # Check for suspicious commands
-        command = src.get("input", "")
-        if any(cmd in command for cmd in settings.SUSPICIOUS_COMMANDS):
-            score += WEIGHTS["suspicious_command"]
-            factors.append("suspicious_command")
-    elif "cowrie.session.file_download" in event_type or "cowrie.session.file_upload" in event_type:
-        score += WEIGHTS["file_transfer"]
-        factors.append("file_transfer")
+    # Cowrie event IDs are exact strings: one dict lookup replaces a chain of
+    # substring checks
+    event_score = _EVENT_TYPE_TABLE.get(event_type)
+    if event_score is not None:
+        score += event_score[0]
+        factors.append(event_score[1])
+        if event_type == "cowrie.command.input":
+            # Check for suspicious commands; empty input skips the matcher
+            command = src.get("input")
+            if command:
+                matcher = _get_suspicious_matcher()
+                if matcher is not None and next(matcher.iter(command), None) is not None:
+                    score += WEIGHTS["suspicious_command"]
+                    factors.append("suspicious_command")
 
     # --- Contextual Scoring ---
-    if src.get("username") in {"root", "admin"}:
+    if src.get("username") in _PRIVILEGED_USERS:
         score += WEIGHTS["privileged_account"]
         factors.append("privileged_account")
 
@@ -283,78 +611,185 @@ async def _score_event(event_type: str, src: Dict[str, Any], timestamp: datetime
         score += WEIGHTS["night_activity"]
         factors.append("night_activity")
         
-    # --- IP Reputation (Placeholder) ---
-    # In a real system, you would call an external service here.
-    # This function is a placeholder to show where to integrate it.
-    if await _check_ip_reputation(src.get("src_ip")):
+    # --- IP Reputation ---
+    # Verdicts come from AbuseIPDB, resolved once per unique IP per batch.
+    if ip_reputation and ip_reputation.get(src.get("src_ip"), False):
         score += WEIGHTS["ip_reputation_risk"]
         factors.append("ip_reputation_risk")
 
     # Clamp score to a 0-100 range
     score = max(0, min(100, score))
-    return score, sorted(list(set(factors))) # Return unique, sorted factors
+    return score, sorted(set(factors)) # Return unique, sorted factors
+
+
+# Recent AbuseIPDB verdicts. No per-IP locks are needed: pages are scored one
+# at a time and each page's IPs are de-duplicated before lookup.
+_ip_reputation_cache: TTLCache = TTLCache(
+    maxsize=settings.IP_REPUTATION_CACHE_SIZE, ttl=settings.IP_REPUTATION_CACHE_TTL_SECONDS
+)
 
 
-async def _check_ip_reputation(ip_address: Optional[str]) -> bool:
+async def _lookup_ip_reputations(
+    ips: Iterable[Optional[str]],
+    client: Optional[httpx.AsyncClient],
+) -> Dict[str, bool]:
+    """Resolve the reputation of each unique IP in `ips` concurrently.
+
+    IPs whose lookup failed are left out, so they score as not risky for this
+    batch and are looked up again in the next one.
+    """
+    if client is None or not settings.ABUSEIPDB_API_KEY:
+        return {}
+    unique_ips = {ip for ip in ips if ip}
+    if not unique_ips:
+        return {}
+    verdicts = await asyncio.gather(*(_cached_ip_reputation(ip, client) for ip in unique_ips))
+    return {ip: verdict for ip, verdict in zip(unique_ips, verdicts) if verdict is not None}
+
+
+async def _cached_ip_reputation(ip_address: str, client: httpx.AsyncClient) -> Optional[bool]:
+    """Return the cached AbuseIPDB verdict for an IP, checking it at most once per TTL.
+
+    Failed lookups (None) are not cached.
+    """
+    verdict = _ip_reputation_cache.get(ip_address)
+    if verdict is None:
+        verdict = await _check_ip_reputation(ip_address, client)
+        if verdict is not None:
+            _ip_reputation_cache[ip_address] = verdict
+    return verdict
+
+
+async def _check_ip_reputation(ip_address: Optional[str], client: httpx.AsyncClient) -> Optional[bool]:
     """
     Check an IP address against the AbuseIPDB API.
     
     Args:
         ip_address: The IP address to check.
+        client: Shared HTTP client, so lookups reuse pooled connections.
         
     Returns:
-        True if the IP is considered high-risk, False otherwise.
+        True if the IP is considered high-risk, False if not, or None if the
+        lookup failed (HTTP error, timeout, rate limiting).
     """
     if not ip_address or not settings.ABUSEIPDB_API_KEY:
         return False
 
     try:
-        async with httpx.AsyncClient() as client:
-            headers = {
-                'Accept': 'application/json',
-                'Key': settings.ABUSEIPDB_API_KEY
-            }
-            params = {
-                'ipAddress': ip_address,
-                'maxAgeInDays': '90'
-            }
-            response = await client.get('https://api.abuseipdb.com/api/v2/check', headers=headers, params=params)
-            response.raise_for_status()
-            data = response.json()
-            
-            if data.get("data", {}).get("abuseConfidenceScore", 0) > settings.ABUSEIPDB_CONFIDENCE_THRESHOLD:
-                logger.info(f"High-risk IP detected: {ip_address} (Score: {data['data']['abuseConfidenceScore']})")
-                return True
-                
+        headers = {
+            'Accept': 'application/json',
+            'Key': settings.ABUSEIPDB_API_KEY
+        }
+        params = {
+            'ipAddress': ip_address,
+            'maxAgeInDays': '90'
+        }
+        response = await client.get('https://api.abuseipdb.com/api/v2/check', headers=headers, params=params)
+        response.raise_for_status()
+        data = response.json()
+
+        if data.get("data", {}).get("abuseConfidenceScore", 0) > settings.ABUSEIPDB_CONFIDENCE_THRESHOLD:
+            logger.info("High-risk IP detected: %s (Score: %s)", ip_address, data["data"]["abuseConfidenceScore"])
+            return True
+        return False
+
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error while checking IP reputation for {ip_address}: {e}")
     except Exception as e:
         logger.error(f"Failed to check IP reputation for {ip_address}: {e}")
-        
-    return False
+
+    return None
+
+
+def _processed_event_id(source_id: str) -> str:
+    """Deterministic processed-index `_id` for the raw document `source_id`."""
+    return hashlib.blake2b(source_id.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _bulk_actions(events: List[ProcessedEvent]) -> Iterator[tuple[bytes, str]]:
+    """Yield one pre-encoded (action line, document) pair per event.
+
+    Actions are bulk creates whose `_id` is derived from the raw document's
+    ID, so a replayed request (a retried timeout, or a poll re-run after a
+    failed chunk) is rejected as a version conflict instead of duplicating
+    the event. Documents are rendered straight to JSON by Pydantic, without
+    an intermediate dict, and the bulk helper's serializer passes pre-encoded
+    lines through untouched.
+    """
+    auto_id_action = orjson.dumps({"create": {"_index": settings.PROCESSED_INDEX}})
+    for evt in events:
+        if evt.source_id is None:
+            yield auto_id_action, evt.model_dump_json()
+            continue
+        action = orjson.dumps({"create": {
+            "_index": settings.PROCESSED_INDEX, "_id": _processed_event_id(evt.source_id)
+        }})
+        yield action, evt.model_dump_json()
+
+
+def _is_duplicate_create(item: Dict[str, Any]) -> bool:
+    """True if a failed bulk item only reports that the document already exists."""
+    result = item.get("create") or {}
+    error = result.get("error")
+    return (
+        result.get("status") == 409
+        and isinstance(error, dict)
+        and error.get("type") == "version_conflict_engine_exception"
+    )
+
+
+def _expand_pre_encoded(action: tuple[bytes, str]) -> tuple[bytes, str]:
+    """Bulk helper callback for actions that are already (header, body) pairs."""
+    return action
+
+
+async def _bulk_index_chunk(
+    es: AsyncElasticsearch,
+    actions: Iterator[tuple[bytes, str]],
+    semaphore: asyncio.Semaphore,
+) -> List[Dict[str, Any]]:
+    """Send one sub-batch of bulk actions, returning its per-item errors."""
+    errors: List[Dict[str, Any]] = []
+    async with semaphore:
+        async for ok, item in async_streaming_bulk(
+            es,
+            actions,
+            chunk_size=settings.BULK_CHUNK_SIZE,
+            max_chunk_bytes=settings.BULK_MAX_CHUNK_BYTES,
+            expand_action_callback=_expand_pre_encoded,
+            max_retries=3,
+            initial_backoff=2,
+            raise_on_error=False,
+            yield_ok=False,
+        ):
+            # Already indexed by an earlier attempt: counts as written
+            if not ok and not _is_duplicate_create(item):
+                errors.append(item)
+    return errors
 
 
 async def _bulk_index_processed(
     es: AsyncElasticsearch,
     events: List[ProcessedEvent],
-    source_hits: List[Dict[str, Any]],
 ) -> None:
-    """Bulk index processed events using deterministic IDs based on source _id."""
+    """Bulk index processed events idempotently (see `_bulk_actions`).
+
+    Events are split into sub-batches of BULK_CHUNK_SIZE documents (each also
+    capped at BULK_MAX_CHUNK_BYTES) and up to BULK_CONCURRENCY of them are
+    in flight at once, so large backlogs keep several of the cluster's write
+    threads busy. Rejected (429) chunks are retried with backoff.
+    """
     if not events:
         return
 
-    # Build bulk body
-    body: List[Dict[str, Any]] = []
-    for evt, hit in zip(events, source_hits):
-        src_id = hit.get("_id")
-        action = {"index": {"_index": settings.PROCESSED_INDEX, "_id": src_id}}
-        body.append(action)
-        body.append(evt.model_dump(mode="json"))
-
-    resp = await es.bulk(operations=body, refresh=False)
-    if resp.get("errors"):
+    size = settings.BULK_CHUNK_SIZE
+    semaphore = asyncio.Semaphore(settings.BULK_CONCURRENCY)
+    results = await asyncio.gather(*(
+        _bulk_index_chunk(es, _bulk_actions(events[i:i + size]), semaphore)
+        for i in range(0, len(events), size)
+    ))
+    errors = [err for chunk_errors in results for err in chunk_errors]
+    if errors:
         # Log first few errors for visibility
-        items = resp.get("items", [])
-        errs = [it for it in items if it.get("index", {}).get("error")]
         logger.warning("Bulk index completed with %d errors (showing up to 3): %s",
-                       len(errs), errs[:3])
+                       len(errors), errors[:3])
@@ -3,11 +3,18 @@ import asyncio
 from contextlib import asynccontextmanager
 import logging
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+import httpx
 from pythonjsonlogger import jsonlogger
 from sentinel.api import endpoints
-from sentinel.core.services import process_new_events, wait_for_elasticsearch
+from sentinel.api.middleware import APIKeyMiddleware, ETagMiddleware, HealthCheckMiddleware
+from sentinel.api.msearch_batcher import MSearchBatcher
+from sentinel.core.services import process_new_events, tune_processed_index, wait_for_elasticsearch
 from sentinel.config.settings import settings
 from elasticsearch import AsyncElasticsearch
+from elastic_transport import OrjsonSerializer
+from redis.asyncio import Redis
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -27,6 +34,14 @@ async def lifespan(app: FastAPI):
     # Initialize the Elasticsearch client and attach it to the app state
     es_kwargs = {
         "hosts": [settings.ELASTICSEARCH_URL],
+        # Size the pool for the worker's concurrency (see settings module docs)
+        "connections_per_node": settings.ES_MAX_CONNECTIONS,
+        "request_timeout": settings.ES_REQUEST_TIMEOUT,
+        "retry_on_timeout": True,
+        # gzip request/response bodies between the app and Elasticsearch
+        "http_compress": True,
+        # Encode request bodies and decode responses with orjson
+        "serializers": {"application/json": OrjsonSerializer()},
     }
     # Optional basic auth
     if settings.ELASTICSEARCH_USERNAME and settings.ELASTICSEARCH_PASSWORD:
@@ -41,40 +56,121 @@ async def lifespan(app: FastAPI):
 
     es_client = AsyncElasticsearch(**es_kwargs)
     app.state.es_client = es_client
-    
-    # Wait for Elasticsearch to be ready before starting the processor
-    await wait_for_elasticsearch(es_client)
-    
-    # Create the background task for processing events
-    processor_task = asyncio.create_task(process_new_events(es_client))
-    
-    # Yield control back to the server, allowing the app to run
-    yield
-    
-    # --- Shutdown ---
-    logging.info("Application shutdown: Cleaning up resources.")
-    # Cancel the background task
-    processor_task.cancel()
+
+    msearch_batcher = None
+    redis_client = None
+    http_client = None
+    processor_task = None
     try:
-        await processor_task
-    except asyncio.CancelledError:
-        logging.info("Background task cancelled.")
-    
-    # Close the Elasticsearch client connection
-    if hasattr(app.state, 'es_client') and app.state.es_client:
-        await app.state.es_client.close()
+        # Everything after the ES client is built inside the try, so a
+        # constructor failure still closes whatever was already created.
+
+        # Batch concurrent API searches into _msearch requests
+        msearch_batcher = MSearchBatcher(
+            es_client,
+            max_batch_size=settings.MSEARCH_MAX_BATCH_SIZE,
+            flush_interval_seconds=settings.MSEARCH_FLUSH_INTERVAL_SECONDS,
+            # Handlers only read `_source`; strip the per-hit envelope server-side
+            filter_path=["responses.hits.hits._source"],
+        )
+        msearch_batcher.start()
+        app.state.msearch_batcher = msearch_batcher
+
+        # Optional Redis result cache for hot API reads
+        redis_client = Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=settings.REDIS_SOCKET_TIMEOUT_SECONDS,
+            socket_connect_timeout=settings.REDIS_CONNECT_TIMEOUT_SECONDS,
+        ) if settings.REDIS_URL else None
+        app.state.redis = redis_client
+
+        # Shared HTTP client for outbound lookups (AbuseIPDB): pooled keep-alive
+        # HTTP/2 connections instead of a new TLS handshake per request
+        http_client = httpx.AsyncClient(
+            http2=True,
+            timeout=5.0,
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=50),
+        )
+        app.state.http = http_client
+
+        # Wait for Elasticsearch to be ready before starting the processor
+        await wait_for_elasticsearch(es_client)
+        # Write tuning for an existing processed index (new indices get it
+        # from the bootstrap-installed template)
+        await tune_processed_index(es_client)
+
+        # Create the background task for processing events
+        processor_task = asyncio.create_task(process_new_events(
+            es_client,
+            poll_interval_seconds=settings.PROCESSOR_MAX_POLL_INTERVAL_SECONDS,
+            min_poll_interval_seconds=settings.PROCESSOR_MIN_POLL_INTERVAL_SECONDS,
+            http_client=http_client,
+        ))
+
+        # Yield control back to the server, allowing the app to run
+        yield
+    finally:
+        # --- Shutdown ---
+        # Runs even when startup fails, so the single process-wide clients are
+        # never leaked with open connection pools.
+        logging.info("Application shutdown: Cleaning up resources.")
+        # Cancel the background task
+        if processor_task is not None:
+            processor_task.cancel()
+            try:
+                await processor_task
+            except asyncio.CancelledError:
+                logging.info("Background task cancelled.")
+            except Exception:
+                logging.exception("Background task had already failed.")
+
+        # Stop batching before the client it sends through is closed
+        if msearch_batcher is not None:
+            await msearch_batcher.close()
+
+        # Close the Elasticsearch client connection
+        await es_client.close()
         logging.info("Elasticsearch client closed.")
 
+        # Close the shared HTTP client's connection pool
+        if http_client is not None:
+            await http_client.aclose()
+
+        # Close the Redis connection pool
+        if redis_client is not None:
+            await redis_client.aclose()
+            logging.info("Redis client closed.")
+
 app = FastAPI(
     title='Project-Sentinel API',
     description='An API for generating and serving high-fidelity threat intelligence.',
     version='1.0.0',
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 app.include_router(endpoints.router, prefix='/api/v1')
 
+# Middleware added last runs first: authentication wraps the response cache
+# so cached /events responses are only ever served to authenticated callers.
+# Conditional GET + short-lived response cache for the polled /events endpoints
+app.add_middleware(ETagMiddleware, max_age_seconds=settings.RESPONSE_CACHE_MAX_AGE_SECONDS)
+# Compress client responses (wraps the cache, which stores uncompressed bodies)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+# X-API-KEY check for /api/v1/events/* before routing
+app.add_middleware(APIKeyMiddleware)
+# Outermost: answer health probes before any other middleware runs
+app.add_middleware(HealthCheckMiddleware)
+
 # Add a root endpoint for simple "hello world"
 @app.get("/", tags=["Root"])
 def read_root():
     return {"message": "Welcome to the Sentinel API. Visit /docs for API documentation."}
+
+
+if __name__ == "__main__":
+    # Local single-process run (`python -m sentinel.main`) with the same C event
+    # loop and HTTP parser as the Gunicorn workers (see sentinel.workers)
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools")
@@ -0,0 +1,14 @@
+"""Gunicorn worker classes for serving the Sentinel API."""
+
+from uvicorn.workers import UvicornWorker
+
+
+class SentinelUvicornWorker(UvicornWorker):
+    """Uvicorn worker pinned to the C event loop (uvloop) and HTTP parser (httptools).
+
+    The stock worker uses "auto", which silently falls back to the pure-Python
+    asyncio loop and h11 parser if either extension is missing; pinning them
+    makes a broken image fail at boot instead of running slowly.
+    """
+
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools"}
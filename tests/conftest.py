@@ -3,3 +3,7 @@ import os
 
 # Add the src directory to the Python path to allow for absolute imports in tests
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+# Settings are bound into module constants at import time, so the test API key
+# must be in the environment before any sentinel module is imported.
+os.environ['API_KEY'] = 'test-key'
@@ -1,14 +1,32 @@
+import asyncio
+
+import anyio
 import pytest
+import pytest_asyncio
 from httpx import AsyncClient, ASGITransport
-from unittest.mock import AsyncMock, MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from sentinel.main import app
-from sentinel.api.endpoints import get_es_client
+from sentinel.main import app, lifespan
+from sentinel.api.endpoints import _build_search_body, _stream_latest, get_cache, get_es_client, get_msearch_batcher
+from sentinel.api.middleware import CachedResponse, HealthCheckMiddleware, ResponseCache, response_cache
 from sentinel.config.settings import settings
 
 # Override API Key for testing purposes
 settings.API_KEY = "test-key"
 
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    """Keeps the in-process response cache from leaking between tests."""
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+@pytest_asyncio.fixture
+async def client():
+    """Provides an HTTP client bound to the app (lifespan is not run)."""
+    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+        yield client
+
 @pytest.fixture
 def api_key():
     """Provides the test API key."""
@@ -25,23 +43,58 @@ def mock_es_client():
     yield mock
     app.dependency_overrides.clear()
 
+@pytest.fixture
+def mock_batcher():
+    """Mocks the _msearch batcher that endpoints submit their searches to."""
+    mock = MagicMock()
+    mock.submit = AsyncMock()
+
+    app.dependency_overrides[get_msearch_batcher] = lambda: mock
+    yield mock
+    app.dependency_overrides.pop(get_msearch_batcher, None)
+
+@pytest.fixture
+def mock_cache():
+    """Mocks the Redis result cache."""
+    mock = MagicMock()
+    mock.get = AsyncMock(return_value=None)
+    mock.set = AsyncMock()
+
+    app.dependency_overrides[get_cache] = lambda: mock
+    yield mock
+    app.dependency_overrides.pop(get_cache, None)
+
 @pytest.mark.asyncio
-async def test_health_check():
+async def test_health_check(client):
     """
     Tests the health check endpoint to ensure the API is responsive.
     """
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
+    response = await client.get("/api/v1/health")
+    assert response.status_code == 200
+    assert response.json() == {"status": "ok"}
+
+@pytest.mark.asyncio
+async def test_health_check_skips_inner_app():
+    """
+    Tests that health probes are answered without reaching the wrapped app.
+    """
+    inner = AsyncMock()
+    probe_app = HealthCheckMiddleware(inner)
+    async with AsyncClient(transport=ASGITransport(app=probe_app), base_url="http://test") as client:
         response = await client.get("/api/v1/health")
-        assert response.status_code == 200
-        assert response.json() == {"status": "ok"}
+
+    assert response.status_code == 200
+    assert response.content == b'{"status":"ok"}'
+    assert response.headers["content-type"] == "application/json"
+    inner.assert_not_called()
 
 @pytest.mark.asyncio
-async def test_get_latest_events(mock_es_client, api_key):
+async def test_get_latest_events(client, mock_batcher, api_key):
     """
     Tests the /events/latest endpoint.
     """
     # Mock the Elasticsearch response
-    mock_es_client.search.return_value = {
+    mock_batcher.submit.return_value = {
         "hits": {
             "hits": [
                 {"_source": {"message": "event 1"}},
@@ -50,20 +103,19 @@ async def test_get_latest_events(mock_es_client, api_key):
         }
     }
     
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
-        response = await client.get("/api/v1/events/latest", headers=api_key)
+    response = await client.get("/api/v1/events/latest", headers=api_key)
         
-        assert response.status_code == 200
-        assert response.json() == [{"message": "event 1"}, {"message": "event 2"}]
-        # Verify that the es_client.search was called correctly
-        mock_es_client.search.assert_called_once()
+    assert response.status_code == 200
+    assert response.json() == [{"message": "event 1"}, {"message": "event 2"}]
+    # Verify that the search was submitted exactly once
+    mock_batcher.submit.assert_called_once()
 
 @pytest.mark.asyncio
-async def test_get_high_risk_events(mock_es_client, api_key):
+async def test_get_high_risk_events(client, mock_batcher, api_key):
     """
     Tests the /events/high-risk endpoint.
     """
-    mock_es_client.search.return_value = {
+    mock_batcher.submit.return_value = {
         "hits": {
             "hits": [
                 {"_source": {"risk_score": 80}},
@@ -71,32 +123,368 @@ async def test_get_high_risk_events(mock_es_client, api_key):
         }
     }
     
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
-        response = await client.get("/api/v1/events/high-risk", headers=api_key)
+    response = await client.get("/api/v1/events/high-risk", headers=api_key)
         
-        assert response.status_code == 200
-        assert response.json() == [{"risk_score": 80}]
+    assert response.status_code == 200
+    assert response.json() == [{"risk_score": 80}]
         
-        # Check that the query sent to Elasticsearch was correct
-        _, kwargs = mock_es_client.search.call_args
-        assert kwargs["query"]["range"]["risk_score"]["gte"] == 70
+    # Check that the query sent to Elasticsearch was correct
+    _, kwargs = mock_batcher.submit.call_args
+    assert kwargs["query"]["range"]["risk_score"]["gte"] == 70
 
 @pytest.mark.asyncio
-async def test_api_key_missing(mock_es_client):
+async def test_api_key_missing(client, mock_es_client):
     """
     Tests that a protected endpoint returns 403 Forbidden without an API key.
     """
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
-        response = await client.get("/api/v1/events/latest")
-        assert response.status_code == 403
-        assert response.json() == {"detail": "Not authenticated"}
+    response = await client.get("/api/v1/events/latest")
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Not authenticated"}
 
 @pytest.mark.asyncio
-async def test_invalid_api_key(mock_es_client):
+async def test_invalid_api_key(client, mock_es_client):
     """
     Tests that a protected endpoint returns 403 Forbidden with an invalid API key.
     """
-    async with AsyncClient(transport=ASGITransport(app=app), base_url="http://test") as client:
-        response = await client.get("/api/v1/events/latest", headers={"X-API-KEY": "invalid-key"})
-        assert response.status_code == 403
-        assert response.json() == {"detail": "Could not validate credentials"}
+    response = await client.get("/api/v1/events/latest", headers={"X-API-KEY": "invalid-key"})
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Could not validate credentials"}
+
+@pytest.mark.asyncio
+async def test_latest_events_cache_hit(client, mock_batcher, mock_cache, api_key):
+    """
+    Tests that a cached result is served without querying Elasticsearch.
+    """
+    mock_cache.get.return_value = b'[{"message":"cached"}]'
+
+    response = await client.get("/api/v1/events/latest?limit=5", headers=api_key)
+
+    assert response.status_code == 200
+    assert response.content == b'[{"message":"cached"}]'
+    assert response.headers["X-Cache"] == "HIT"
+    mock_cache.get.assert_called_once_with("sentinel:latest:5")
+    mock_batcher.submit.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_high_risk_events_cache_miss(client, mock_batcher, mock_cache, api_key):
+    """
+    Tests that a cache miss queries Elasticsearch and stores the result.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": [{"_source": {"risk_score": 90}}]}}
+
+    response = await client.get("/api/v1/events/high-risk", headers=api_key)
+
+    assert response.status_code == 200
+    assert response.headers["X-Cache"] == "MISS"
+    key, payload = mock_cache.set.call_args.args
+    assert key == "sentinel:high-risk:25"
+    assert payload == b'[{"risk_score":90}]'
+    assert mock_cache.set.call_args.kwargs["ex"] == settings.CACHE_TTL_SECONDS
+
+@pytest.mark.asyncio
+async def test_lifespan_closes_client_when_startup_fails():
+    """
+    Tests that the shared Elasticsearch client is closed even if startup fails.
+    """
+    es_client = MagicMock()
+    es_client.close = AsyncMock()
+
+    with patch("sentinel.main.AsyncElasticsearch", return_value=es_client), \
+            patch("sentinel.main.wait_for_elasticsearch", AsyncMock(side_effect=TimeoutError)):
+        with pytest.raises(TimeoutError):
+            async with lifespan(app):
+                pass
+
+    es_client.close.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_lifespan_closes_clients_when_a_client_constructor_fails():
+    """
+    Tests that a failing Redis constructor still closes the ES client and batcher.
+    """
+    es_client = MagicMock()
+    es_client.close = AsyncMock()
+    batcher = MagicMock()
+    batcher.close = AsyncMock()
+
+    with patch("sentinel.main.AsyncElasticsearch", return_value=es_client), \
+            patch("sentinel.main.MSearchBatcher", return_value=batcher), \
+            patch.object(settings, "REDIS_URL", "redis://redis:6379/0"), \
+            patch("sentinel.main.Redis.from_url", side_effect=ValueError("bad url")):
+        with pytest.raises(ValueError):
+            async with lifespan(app):
+                pass
+
+    batcher.close.assert_awaited_once()
+    es_client.close.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_conditional_get_returns_304(client, mock_batcher, api_key):
+    """
+    Tests that a repeat poll with a matching ETag gets 304 without a new search.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": [{"_source": {"message": "event 1"}}]}}
+
+    first = await client.get("/api/v1/events/latest", headers=api_key)
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "private, max-age=2"
+    etag = first.headers["ETag"]
+
+    second = await client.get("/api/v1/events/latest", headers={**api_key, "If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    assert second.content == b""
+
+    # Without If-None-Match the cached body is replayed
+    third = await client.get("/api/v1/events/latest", headers=api_key)
+    assert third.status_code == 200
+    assert third.json() == [{"message": "event 1"}]
+
+    mock_batcher.submit.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_response_cache_requires_api_key(client, mock_batcher, api_key):
+    """
+    Tests that cached responses are never served to unauthenticated callers.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": []}}
+
+    first = await client.get("/api/v1/events/latest", headers=api_key)
+    etag = first.headers["ETag"]
+
+    response = await client.get("/api/v1/events/latest", headers={"If-None-Match": etag})
+    assert response.status_code == 403
+
+@pytest.mark.asyncio
+async def test_search_responses_are_not_stored(client, mock_batcher, api_key):
+    """
+    Tests that /events/search responses carry an ETag but are never replayed from memory.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": []}}
+
+    first = await client.get("/api/v1/events/search", params={"source_ip": "1.2.3.4"}, headers=api_key)
+    second = await client.get("/api/v1/events/search", params={"source_ip": "1.2.3.4"}, headers=api_key)
+
+    assert "etag" in first.headers
+    assert mock_batcher.submit.call_count == 2
+    assert second.status_code == 200
+
+def test_response_cache_is_bounded_by_bytes(monkeypatch):
+    """
+    Tests that the response cache evicts by total body size, skips oversized
+    bodies and purges expired entries on write.
+    """
+    now = 100.0
+    monkeypatch.setattr("sentinel.api.middleware.time.monotonic", lambda: now)
+    cache = ResponseCache(max_entries=10, max_bytes=10, max_entry_bytes=6)
+
+    cache.set(("a", b""), CachedResponse(b"", [], b"x" * 4, now + 1))
+    cache.set(("b", b""), CachedResponse(b"", [], b"x" * 4, now + 5))
+    cache.set(("big", b""), CachedResponse(b"", [], b"x" * 7, now + 5))
+    assert cache.get(("big", b"")) is None
+
+    cache.set(("c", b""), CachedResponse(b"", [], b"x" * 4, now + 5))
+    assert cache.get(("a", b"")) is None  # evicted to stay within 10 bytes
+    assert cache.get(("b", b"")) is not None
+
+    now = 106.0
+    cache.set(("d", b""), CachedResponse(b"", [], b"x", now + 5))
+    assert list(cache._entries) == [("d", b"")]
+    assert cache._bytes == 1
+
+@pytest.mark.asyncio
+async def test_api_key_enforced_under_root_path(mock_es_client, mock_batcher):
+    """
+    Tests that a mount/proxy prefix (root_path) does not bypass the API key check.
+    """
+    transport = ASGITransport(app=app, root_path="/sentinel")
+    async with AsyncClient(transport=transport, base_url="http://test") as prefixed:
+        response = await prefixed.get("/sentinel/api/v1/events/latest")
+
+    assert response.status_code == 403
+    mock_batcher.submit.assert_not_called()
+
+def test_openapi_declares_api_key_scheme():
+    """
+    Tests that /docs advertises the X-API-KEY scheme on the /events routes.
+    """
+    schema = app.openapi()
+    assert schema["components"]["securitySchemes"]["APIKeyHeader"]["name"] == "X-API-KEY"
+    assert schema["paths"]["/api/v1/events/latest"]["get"]["security"] == [{"APIKeyHeader": []}]
+    assert "security" not in schema["paths"]["/api/v1/health"]["get"]
+
+@pytest.mark.asyncio
+async def test_non_ascii_api_key_rejected(client, mock_es_client):
+    """
+    Tests that a non-ASCII API key header is rejected rather than erroring.
+    """
+    response = await client.get("/api/v1/events/latest", headers={"X-API-KEY": "test-k\u00e9y".encode("latin-1")})
+    assert response.status_code == 403
+    assert response.json() == {"detail": "Could not validate credentials"}
+
+@pytest.mark.asyncio
+async def test_search_events_uses_filter_context(client, mock_batcher, api_key):
+    """
+    Tests that /events/search sends its criteria as non-scoring filters.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": [{"_source": {"source_ip": "1.2.3.4"}}]}}
+
+    response = await client.get(
+        "/api/v1/events/search",
+        params={"source_ip": "1.2.3.4", "min_risk_score": 50},
+        headers=api_key,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [{"source_ip": "1.2.3.4"}]
+    query = mock_batcher.submit.call_args.kwargs["query"]
+    assert query == {
+        "bool": {
+            "filter": [
+                {"term": {"source_ip.keyword": "1.2.3.4"}},
+                {"range": {"risk_score": {"gte": 50}}},
+            ]
+        }
+    }
+
+@pytest.mark.asyncio
+async def test_search_events_canonicalizes_ipv6_source_ip(client, mock_batcher, api_key):
+    """
+    Tests that an IPv6 filter is sent in its canonical compressed form.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": []}}
+
+    response = await client.get(
+        "/api/v1/events/search", params={"source_ip": "2001:DB8:0:0::1"}, headers=api_key
+    )
+
+    assert response.status_code == 200
+    query = mock_batcher.submit.call_args.kwargs["query"]
+    assert query == {"bool": {"filter": [{"term": {"source_ip.keyword": "2001:db8::1"}}]}}
+
+@pytest.mark.asyncio
+async def test_large_responses_are_gzipped(client, mock_batcher, api_key):
+    """
+    Tests that large event pages are gzip-compressed for clients that accept it.
+    """
+    hits = [{"_source": {"message": f"event {i}", "risk_factors": ["geo_risk"]}} for i in range(100)]
+    mock_batcher.submit.return_value = {"hits": {"hits": hits}}
+
+    response = await client.get("/api/v1/events/latest?limit=100", headers={**api_key, "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert len(response.json()) == 100
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("params", [
+    {"source_ip": "not-an-ip"},
+    {"source_ip": ":::"},
+    {"source_ip": "1.2.3.4.5.6"},
+    {"source_ip": "999.1.1.1"},
+    {"source_ip": "1:2:3:4:5:6:7:8:9"},
+    {"start_date": "yesterday"},
+    {"end_date": "2024-13-01T00:00:00Z"},
+])
+async def test_search_events_rejects_malformed_params(client, mock_batcher, api_key, params):
+    """
+    Tests that malformed search parameters are rejected before querying Elasticsearch.
+    """
+    response = await client.get("/api/v1/events/search", params=params, headers=api_key)
+
+    assert response.status_code == 422
+    mock_batcher.submit.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_search_events_date_range(client, mock_batcher, api_key):
+    """
+    Tests that ISO 8601 dates are normalized into the timestamp range filter.
+    """
+    mock_batcher.submit.return_value = {"hits": {"hits": []}}
+
+    response = await client.get(
+        "/api/v1/events/search",
+        params={"start_date": "2024-01-01T00:00:00Z", "end_date": "2024-01-02T00:00:00+02:00"},
+        headers=api_key,
+    )
+
+    assert response.status_code == 200
+    assert response.json() == []
+    query = mock_batcher.submit.call_args.kwargs["query"]
+    assert query["bool"]["filter"] == [
+        {"range": {"timestamp": {"gte": "2024-01-01T00:00:00+00:00", "lte": "2024-01-02T00:00:00+02:00"}}}
+    ]
+
+def test_search_body_is_memoized():
+    """
+    Tests that identical filter combinations reuse one prebuilt search body.
+    """
+    first = _build_search_body("1.2.3.4", None, None, 50, 100)
+    assert _build_search_body("1.2.3.4", None, None, 50, 100) is first
+    assert _build_search_body("1.2.3.4", None, None, 60, 100) is not first
+    assert first["size"] == 100
+
+@pytest.mark.asyncio
+async def test_stream_events_pages_with_search_after(client, mock_es_client, api_key):
+    """
+    Tests that /events/stream pages through a PIT and emits one NDJSON line per event.
+    """
+    mock_es_client.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+    mock_es_client.close_point_in_time = AsyncMock()
+    mock_es_client.search.side_effect = [
+        {"pit_id": "pit-2", "hits": {"hits": [
+            {"_source": {"message": f"event {n}"}, "sort": [n, n]} for n in range(100)
+        ]}},
+        {"pit_id": "pit-2", "hits": {"hits": [
+            {"_source": {"message": "event 100"}, "sort": [100, 100]}
+        ]}},
+    ]
+
+    response = await client.get("/api/v1/events/stream?limit=150", headers=api_key)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert "etag" not in response.headers
+    lines = response.text.splitlines()
+    assert len(lines) == 101
+    assert lines[-1] == '{"message":"event 100"}'
+
+    # The short second page ends the stream without a third, empty search
+    first, second = (c.kwargs for c in mock_es_client.search.call_args_list)
+    assert first["pit"]["id"] == "pit-1" and first["search_after"] is None
+    assert second["pit"]["id"] == "pit-2" and second["search_after"] == [99, 99]
+    assert second["size"] == 50
+    mock_es_client.close_point_in_time.assert_awaited_once_with(id="pit-2")
+
+@pytest.mark.asyncio
+async def test_stream_closes_pit_on_client_disconnect():
+    """
+    Tests that the PIT is closed when the stream is cancelled mid-fetch, as
+    Starlette does through an anyio task group on client disconnect.
+    """
+    fetching = asyncio.Event()
+    closed = []
+
+    async def search(**kwargs):
+        fetching.set()
+        await asyncio.Event().wait()
+
+    async def close_point_in_time(id):
+        await asyncio.sleep(0)  # a checkpoint, as a real request has
+        closed.append(id)
+
+    es = MagicMock()
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+    es.search = search
+    es.close_point_in_time = close_point_in_time
+
+    async def consume():
+        async for _ in _stream_latest(es, limit=10):
+            pass
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(consume)
+        await fetching.wait()
+        tg.cancel_scope.cancel()
+
+    assert closed == ["pit-1"]
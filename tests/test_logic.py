@@ -1,8 +1,12 @@
 
 import pytest
 from datetime import datetime, timezone
-from unittest.mock import patch
-from sentinel.core.services import _score_event
+from unittest.mock import AsyncMock, MagicMock, patch
+from elasticsearch import NotFoundError
+import asyncio
+import httpx
+import orjson
+from sentinel.core.services import RAW_PAGE_SIZE, RAW_PAGE_SIZE_MAX, RAW_PAGE_SIZE_MIN, _observe_raw_page, _raw_page_size, _bulk_actions, _processed_event_id, tune_processed_index, _bulk_index_processed, _extract_timestamp, _transform_and_score, _fetch_recent_raw, _ip_reputation_cache, _lookup_ip_reputations, _run_ingest_pipeline, _get_suspicious_matcher, _next_poll_interval, _score_event, wait_for_elasticsearch
 from sentinel.config.settings import settings
 
 # A fixed timestamp for consistent testing
@@ -59,9 +63,13 @@ risk_score_test_cases = [
     ),
 ]
 
-@pytest.mark.asyncio
-@pytest.mark.parametrize("event_type, src, expected_score, expected_factors", risk_score_test_cases)
-async def test_score_event(event_type, src, expected_score, expected_factors):
+# Readable test IDs from the expected factors; pytest suffixes repeats
+risk_score_test_ids = ["+".join(case[3]) or "no_factors" for case in risk_score_test_cases]
+
+@pytest.mark.parametrize(
+    "event_type, src, expected_score, expected_factors", risk_score_test_cases, ids=risk_score_test_ids
+)
+def test_score_event(event_type, src, expected_score, expected_factors):
     """
     Tests the _score_event function with various event payloads and contexts.
     """
@@ -72,17 +80,17 @@ async def test_score_event(event_type, src, expected_score, expected_factors):
     settings.SUSPICIOUS_COMMANDS = ["wget", "curl", "apt-get", "yum"]
     settings.GEOIP_RISK_COUNTRIES = ["Russia", "North Korea", "Iran"]
 
-    with patch('sentinel.core.services._check_ip_reputation') as mock_check_ip:
-        # Mock the return value of the IP reputation check
-        mock_check_ip.return_value = "ip_reputation_risk" in expected_factors
-        
-        score, factors = await _score_event(event_type=event_type, src=src, timestamp=timestamp)
+    # Prefetched IP reputation verdicts for the batch
+    ip_reputation = {"1.2.3.4": "ip_reputation_risk" in expected_factors}
+
+    score, factors = _score_event(
+        event_type=event_type, src=src, timestamp=timestamp, ip_reputation=ip_reputation
+    )
     
     assert score == expected_score
     assert set(factors) == set(expected_factors)
 
-@pytest.mark.asyncio
-async def test_score_clamping():
+def test_score_clamping():
     """
     Ensures the score is always clamped between 0 and 100.
     """
@@ -91,14 +99,336 @@ async def test_score_clamping():
     src = {
         "username": "root",
         "input": "wget evil.sh",
-        "geoip": {"country_name": "Russia"}
+        "geoip": {"country_name": "Russia"},
+        "src_ip": "1.2.3.4",
     }
     timestamp = datetime.now(timezone.utc)
-    
-    with patch('sentinel.core.services._check_ip_reputation') as mock_check_ip:
-        mock_check_ip.return_value = True
-        # Manually calculate expected score without clamping to prove the point
-        # 80 (login) + 15 (root) + 10 (geo) + 50 (ip_rep) = 155
-        
-        score, _ = await _score_event(event_type=event_type, src=src, timestamp=timestamp)
-        assert score == 100
+
+    # Manually calculate expected score without clamping to prove the point
+    # 80 (login) + 15 (root) + 10 (geo) + 50 (ip_rep) = 155
+    score, _ = _score_event(
+        event_type=event_type, src=src, timestamp=timestamp, ip_reputation={"1.2.3.4": True}
+    )
+    assert score == 100
+
+@pytest.mark.asyncio
+async def test_wait_for_elasticsearch_backs_off():
+    """
+    Ensures readiness long-polls cluster health, backing off only on connection errors.
+    """
+    es_client = MagicMock()
+    health = es_client.options.return_value.cluster.health = AsyncMock(side_effect=[
+        ConnectionError(),
+        ConnectionError(),
+        {"status": "red", "timed_out": True},
+        {"status": "yellow", "timed_out": False},
+    ])
+
+    with patch("sentinel.core.services.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+        await wait_for_elasticsearch(es_client, backoff_schedule=(0.2, 0.5))
+
+    assert [c.args[0] for c in mock_sleep.call_args_list] == [0.2, 0.5]
+    assert health.call_count == 4
+    assert health.call_args.kwargs["wait_for_status"] == "yellow"
+    assert es_client.options.call_args.kwargs["ignore_status"] == 408
+
+@pytest.mark.parametrize("current, had_events, expected", [
+    (4.0, True, 2.0),
+    (0.6, True, 0.5),   # floored at the minimum
+    (2.0, False, 4.0),
+    (8.0, False, 10.0), # capped at the maximum
+])
+def test_next_poll_interval_adapts(current, had_events, expected):
+    """
+    Ensures the poll interval halves on busy polls and doubles on idle ones.
+    """
+    assert _next_poll_interval(current, had_events, minimum=0.5, maximum=10.0) == expected
+
+def test_suspicious_matcher_follows_settings(monkeypatch):
+    """
+    Ensures the command automaton is rebuilt when SUSPICIOUS_COMMANDS changes.
+    """
+    monkeypatch.setattr(settings, "SUSPICIOUS_COMMANDS", ["wget"])
+    assert next(_get_suspicious_matcher().iter("nmap -sS 10.0.0.1"), None) is None
+
+    monkeypatch.setattr(settings, "SUSPICIOUS_COMMANDS", ["wget", "nmap"])
+    assert next(_get_suspicious_matcher().iter("nmap -sS 10.0.0.1"), None) is not None
+
+    monkeypatch.setattr(settings, "SUSPICIOUS_COMMANDS", [])
+    assert _get_suspicious_matcher() is None
+
+def _raw_page(count, start=0):
+    return {"hits": {"hits": [{"_id": str(n), "sort": [n, n]} for n in range(start, start + count)]}}
+
+@pytest.mark.asyncio
+async def test_fetch_recent_raw_single_page_skips_pit(monkeypatch):
+    """
+    Ensures a poll that fits in one page never opens a point in time.
+    """
+    monkeypatch.setattr("sentinel.core.services._avg_raw_hit_bytes", None)
+    es = MagicMock()
+    es.search = AsyncMock(return_value=_raw_page(3))
+    es.open_point_in_time = AsyncMock()
+
+    pages = [page async for page in _fetch_recent_raw(es, since=TEST_TIMESTAMP)]
+
+    assert [len(page) for page in pages] == [3]
+    es.open_point_in_time.assert_not_called()
+    assert "input" in es.search.call_args.kwargs["_source"]
+    assert "hits.hits._id" in es.search.call_args.kwargs["filter_path"]
+
+@pytest.mark.asyncio
+async def test_fetch_recent_raw_backlog_pages_through_pit(monkeypatch):
+    """
+    Ensures a full first page switches to PIT paging with a _shard_doc tiebreaker.
+    """
+    monkeypatch.setattr("sentinel.core.services._avg_raw_hit_bytes", None)
+    es = MagicMock()
+    es.search = AsyncMock(side_effect=[
+        _raw_page(RAW_PAGE_SIZE),
+        _raw_page(RAW_PAGE_SIZE),
+        _raw_page(2, start=RAW_PAGE_SIZE),
+    ])
+    es.open_point_in_time = AsyncMock(return_value={"id": "pit-1"})
+    es.close_point_in_time = AsyncMock()
+
+    pages = [page async for page in _fetch_recent_raw(es, since=TEST_TIMESTAMP)]
+
+    assert [len(page) for page in pages] == [RAW_PAGE_SIZE, 2]
+    _, first_pit_page, second_pit_page = (c.kwargs for c in es.search.call_args_list)
+    assert first_pit_page["sort"][-1] == {"_shard_doc": "asc"}
+    assert first_pit_page["search_after"] is None
+    assert {"pit_id", "hits.hits.sort"} <= set(first_pit_page["filter_path"])
+    assert second_pit_page["search_after"] == [RAW_PAGE_SIZE - 1, RAW_PAGE_SIZE - 1]
+    es.close_point_in_time.assert_awaited_once_with(id="pit-1")
+
+@pytest.mark.asyncio
+async def test_bulk_index_runs_sub_batches_concurrently(monkeypatch):
+    """
+    Ensures bulk indexing splits events into sub-batches sent with bounded concurrency.
+    """
+    monkeypatch.setattr(settings, "BULK_CHUNK_SIZE", 2)
+    monkeypatch.setattr(settings, "BULK_CONCURRENCY", 2)
+    in_flight = peak = 0
+    batches = []
+    ids = []
+
+    async def fake_streaming_bulk(es, actions, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        pairs = list(map(kwargs["expand_action_callback"], actions))
+        batches.append([orjson.loads(body)["source_id"] for _, body in pairs])
+        ids.extend(orjson.loads(header)["create"]["_id"] for header, _ in pairs)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        yield False, {"create": {"error": "boom"}}
+
+    events = [
+        MagicMock(source_id=str(n), **{"model_dump_json.return_value": f'{{"source_id":"{n}"}}'})
+        for n in range(5)
+    ]
+    with patch("sentinel.core.services.async_streaming_bulk", fake_streaming_bulk), \
+         patch("sentinel.core.services.logger") as mock_logger:
+        await _bulk_index_processed(MagicMock(), events)
+
+    assert sorted(batches) == [["0", "1"], ["2", "3"], ["4"]]
+    assert peak == 2
+    assert mock_logger.warning.call_args.args[1] == 3
+    assert sorted(ids) == sorted(_processed_event_id(str(n)) for n in range(5))
+
+@pytest.mark.asyncio
+async def test_bulk_index_treats_existing_documents_as_written():
+    """
+    Ensures replayed creates rejected with a 409 version conflict are not errors.
+    """
+    async def fake_streaming_bulk(es, actions, **kwargs):
+        for _ in actions:
+            yield False, {"create": {"status": 409, "error": {"type": "version_conflict_engine_exception"}}}
+
+    event = _transform_and_score({
+        "_id": "raw-1",
+        "_source": {"@timestamp": "2024-01-01T12:00:00Z", "eventid": "cowrie.login.failed"},
+    })
+    with patch("sentinel.core.services.async_streaming_bulk", fake_streaming_bulk), \
+         patch("sentinel.core.services.logger") as mock_logger:
+        await _bulk_index_processed(MagicMock(), [event, event])
+
+    mock_logger.warning.assert_not_called()
+    action, _ = next(_bulk_actions([event]))
+    assert orjson.loads(action)["create"]["_id"] == _processed_event_id("raw-1")
+
+@pytest.mark.asyncio
+async def test_ip_reputation_is_checked_once_per_unique_ip(monkeypatch):
+    """
+    Ensures a batch checks each distinct IP once and later batches hit the cache.
+    """
+    monkeypatch.setattr(settings, "ABUSEIPDB_API_KEY", "test-abuseipdb-key")
+    _ip_reputation_cache.clear()
+
+    with patch("sentinel.core.services._check_ip_reputation", new_callable=AsyncMock) as mock_check_ip:
+        mock_check_ip.side_effect = lambda ip, client: ip == "6.6.6.6"
+        http_client = MagicMock()
+        first = await _lookup_ip_reputations(["6.6.6.6", "1.1.1.1", "6.6.6.6", None], http_client)
+        second = await _lookup_ip_reputations(["6.6.6.6", "1.1.1.1"], http_client)
+    _ip_reputation_cache.clear()
+
+    assert first == second == {"6.6.6.6": True, "1.1.1.1": False}
+    assert sorted(c.args[0] for c in mock_check_ip.call_args_list) == ["1.1.1.1", "6.6.6.6"]
+
+@pytest.mark.asyncio
+async def test_failed_ip_reputation_lookup_is_not_cached(monkeypatch):
+    """
+    Ensures a failed lookup (e.g. AbuseIPDB rate limiting) is retried on the next batch.
+    """
+    monkeypatch.setattr(settings, "ABUSEIPDB_API_KEY", "test-abuseipdb-key")
+    _ip_reputation_cache.clear()
+    client = MagicMock()
+    client.get = AsyncMock(side_effect=[
+        httpx.Response(429, request=httpx.Request("GET", "https://api.abuseipdb.com/api/v2/check")),
+        httpx.Response(200, json={"data": {"abuseConfidenceScore": 100}},
+                       request=httpx.Request("GET", "https://api.abuseipdb.com/api/v2/check")),
+    ])
+
+    assert await _lookup_ip_reputations(["6.6.6.6"], client) == {}
+    assert "6.6.6.6" not in _ip_reputation_cache
+    assert await _lookup_ip_reputations(["6.6.6.6"], client) == {"6.6.6.6": True}
+    assert client.get.await_count == 2
+
+@pytest.mark.asyncio
+async def test_tune_processed_index_applies_write_settings_only():
+    """
+    Ensures only dynamic write tuning is applied to the existing index, and a
+    missing index is not treated as an error.
+    """
+    es = MagicMock()
+    es.indices.put_settings = AsyncMock(side_effect=NotFoundError("index_not_found", MagicMock(), {}))
+
+    await tune_processed_index(es)
+
+    existing = es.indices.put_settings.call_args.kwargs["settings"]["index"]
+    assert existing["translog"]["durability"] == "async"
+    assert "codec" not in existing
+    assert "number_of_replicas" not in existing
+    es.indices.put_index_template.assert_not_called()
+
+def test_extract_timestamp_parses_once():
+    """
+    Ensures RFC 3339 timestamps with a trailing Z parse to aware UTC datetimes
+    and are memoized on the hit.
+    """
+    hit = {"_id": "1", "_source": {"@timestamp": "2024-01-01T12:30:00.123Z"}}
+
+    ts = _extract_timestamp(hit)
+
+    assert ts == datetime(2024, 1, 1, 12, 30, 0, 123000, tzinfo=timezone.utc)
+    hit["_source"]["@timestamp"] = "not a timestamp"
+    assert _extract_timestamp(hit) is ts
+
+@pytest.mark.asyncio
+async def test_ingest_pipeline_batches_scored_pages(monkeypatch):
+    """
+    Ensures fetched pages are scored and indexed in bulk batches of at most
+    BULK_CHUNK_SIZE events, and the newest processed timestamp is reported.
+    """
+    monkeypatch.setattr(settings, "BULK_CHUNK_SIZE", 4)
+
+    def page(start):
+        return [
+            {"_id": str(n), "_source": {"@timestamp": f"2024-01-01T00:00:0{n}Z", "eventid": "cowrie.login.failed"}}
+            for n in range(start, start + 2)
+        ]
+
+    async def fake_fetch(es, since):
+        for start in (0, 2, 4):
+            yield page(start)
+
+    with patch("sentinel.core.services._fetch_recent_raw", fake_fetch), \
+         patch("sentinel.core.services._bulk_index_processed", new_callable=AsyncMock) as mock_bulk:
+        fetched, newest_ts = await _run_ingest_pipeline(MagicMock(), since=TEST_TIMESTAMP)
+
+    assert fetched == 6
+    assert newest_ts == datetime(2024, 1, 1, 0, 0, 5, tzinfo=timezone.utc)
+    batches = [c.args[1] for c in mock_bulk.call_args_list]
+    assert all(len(batch) <= 4 for batch in batches)
+    assert [evt.source_id for batch in batches for evt in batch] == [str(n) for n in range(6)]
+
+@pytest.mark.asyncio
+async def test_ingest_pipeline_overlaps_bulk_requests(monkeypatch):
+    """
+    Ensures the pipeline keeps up to BULK_CONCURRENCY bulk batches in flight.
+    """
+    monkeypatch.setattr(settings, "BULK_CHUNK_SIZE", 1)
+    monkeypatch.setattr(settings, "BULK_CONCURRENCY", 3)
+    in_flight = peak = 0
+
+    async def fake_fetch(es, since):
+        for n in range(6):
+            yield [{"_id": str(n), "_source": {"@timestamp": "2024-01-01T00:00:00Z", "eventid": "cowrie.login.failed"}}]
+
+    async def fake_bulk(es, batch):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    with patch("sentinel.core.services._fetch_recent_raw", fake_fetch), \
+         patch("sentinel.core.services._bulk_index_processed", fake_bulk):
+        fetched, _ = await _run_ingest_pipeline(MagicMock(), since=TEST_TIMESTAMP)
+
+    assert fetched == 6
+    assert peak == 3
+
+@pytest.mark.asyncio
+async def test_ingest_pipeline_closes_fetch_generator_when_a_stage_fails():
+    """
+    Ensures the raw fetch generator is closed (releasing its PIT) as soon as
+    the pipeline fails, not later by the garbage collector.
+    """
+    closed = []
+    generators = []  # keep a reference, as a traceback cycle would, so GC can't close it
+
+    async def pages():
+        try:
+            while True:
+                yield [{"_id": "1", "_source": {"@timestamp": "2024-01-01T00:00:00Z", "eventid": "cowrie.login.failed"}}]
+        finally:
+            closed.append(True)
+
+    def fake_fetch(es, since):
+        generators.append(pages())
+        return generators[-1]
+
+    with patch("sentinel.core.services._fetch_recent_raw", fake_fetch), \
+         patch("sentinel.core.services._lookup_ip_reputations", AsyncMock(side_effect=RuntimeError)):
+        with pytest.raises(ExceptionGroup):
+            await _run_ingest_pipeline(MagicMock(), since=TEST_TIMESTAMP)
+
+    assert closed == [True]
+
+@pytest.mark.parametrize("drop_zero_score, kept", [(True, False), (False, True)])
+def test_zero_score_events_are_dropped(monkeypatch, drop_zero_score, kept):
+    """
+    Ensures events without risk signal are skipped only when DROP_ZERO_SCORE is set.
+    """
+    monkeypatch.setattr(settings, "DROP_ZERO_SCORE", drop_zero_score)
+    hit = {"_id": "1", "_source": {"@timestamp": "2024-01-01T12:00:00Z", "eventid": "cowrie.session.connect"}}
+
+    assert (_transform_and_score(hit) is not None) is kept
+
+def test_raw_page_size_follows_observed_hit_size(monkeypatch):
+    """
+    Ensures the raw page size scales inversely with the average hit size, within bounds.
+    """
+    monkeypatch.setattr("sentinel.core.services._avg_raw_hit_bytes", None)
+    monkeypatch.setattr(settings, "PAGE_MAX_BYTES", 100_000)
+    assert _raw_page_size() == RAW_PAGE_SIZE
+
+    _observe_raw_page([{"_source": {"message": "x" * 980}}])
+    assert 90 <= _raw_page_size() <= 100
+
+    monkeypatch.setattr("sentinel.core.services._avg_raw_hit_bytes", 1.0)
+    assert _raw_page_size() == RAW_PAGE_SIZE_MAX
+    monkeypatch.setattr("sentinel.core.services._avg_raw_hit_bytes", 1e9)
+    assert _raw_page_size() == RAW_PAGE_SIZE_MIN
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from unittest.mock import AsyncMock, MagicMock
+
+from sentinel.api.msearch_batcher import MSearchBatcher, MSearchError
+
+
+def _hits(*sources):
+    return {"hits": {"hits": [{"_source": s} for s in sources]}}
+
+
+@pytest.fixture
+def mock_es_client():
+    """Elasticsearch client whose msearch echoes one response per search."""
+    mock = MagicMock()
+
+    async def msearch(searches, **kwargs):
+        bodies = searches[1::2]
+        return {"responses": [_hits({"size": body.get("size")}) for body in bodies]}
+
+    mock.msearch = AsyncMock(side_effect=msearch)
+    return mock
+
+
+@pytest.mark.asyncio
+async def test_concurrent_submits_share_one_msearch(mock_es_client):
+    """
+    Searches submitted within the flush window are sent as a single _msearch.
+    """
+    batcher = MSearchBatcher(mock_es_client, flush_interval_seconds=0.05)
+    batcher.start()
+    try:
+        results = await asyncio.gather(
+            *(batcher.submit(index="idx", query={"match_all": {}}, size=n) for n in (1, 2, 3))
+        )
+    finally:
+        await batcher.close()
+
+    mock_es_client.msearch.assert_called_once()
+    searches = mock_es_client.msearch.call_args.kwargs["searches"]
+    assert searches[0] == {"index": "idx"}
+    assert [r["hits"]["hits"][0]["_source"]["size"] for r in results] == [1, 2, 3]
+
+
+@pytest.mark.asyncio
+async def test_batch_size_is_capped(mock_es_client):
+    """
+    No single _msearch carries more than max_batch_size searches.
+    """
+    batcher = MSearchBatcher(mock_es_client, max_batch_size=2, flush_interval_seconds=0.05)
+    batcher.start()
+    try:
+        await asyncio.gather(*(batcher.submit(index="idx", query={}, size=n) for n in range(5)))
+    finally:
+        await batcher.close()
+
+    batch_sizes = [len(c.kwargs["searches"]) // 2 for c in mock_es_client.msearch.call_args_list]
+    assert max(batch_sizes) == 2
+    assert sum(batch_sizes) == 5
+
+
+@pytest.mark.asyncio
+async def test_item_error_is_raised_to_its_caller(mock_es_client):
+    """
+    A failed entry in the _msearch response only fails the search that caused it.
+    """
+    mock_es_client.msearch = AsyncMock(return_value={
+        "responses": [
+            _hits({"ok": True}),
+            {"status": 400, "error": {"type": "parsing_exception"}},
+        ]
+    })
+    batcher = MSearchBatcher(mock_es_client, flush_interval_seconds=0.05)
+    batcher.start()
+    try:
+        ok, failed = await asyncio.gather(
+            batcher.submit(index="idx", query={}),
+            batcher.submit(index="idx", query={"bad": {}}),
+            return_exceptions=True,
+        )
+    finally:
+        await batcher.close()
+
+    assert ok["hits"]["hits"][0]["_source"] == {"ok": True}
+    assert isinstance(failed, MSearchError)
+    assert failed.status == 400
+
+
+@pytest.mark.asyncio
+async def test_filter_path_keeps_status_and_error(mock_es_client):
+    """
+    Response filtering always keeps per-entry status so results stay aligned.
+    """
+    batcher = MSearchBatcher(mock_es_client, filter_path=["responses.hits.hits._source"])
+    batcher.start()
+    try:
+        await batcher.submit(index="idx", query={}, size=1, track_total_hits=False)
+    finally:
+        await batcher.close()
+
+    kwargs = mock_es_client.msearch.call_args.kwargs
+    assert kwargs["filter_path"] == [
+        "responses.hits.hits._source", "responses.status", "responses.error"
+    ]
+    assert kwargs["searches"][1]["track_total_hits"] is False
+
+
+@pytest.mark.asyncio
+async def test_header_params_go_to_header_line(mock_es_client):
+    """
+    Header-only options such as preference are sent in the _msearch header line.
+    """
+    batcher = MSearchBatcher(mock_es_client)
+    batcher.start()
+    try:
+        await batcher.submit(
+            index="idx", query={}, size=1, request_cache=True, preference="_local", track_total_hits=False
+        )
+    finally:
+        await batcher.close()
+
+    header, body = mock_es_client.msearch.call_args.kwargs["searches"]
+    assert header == {"index": "idx", "request_cache": True, "preference": "_local"}
+    assert body == {"query": {}, "size": 1, "track_total_hits": False}